@@ -0,0 +1,5 @@
+# a """ quote
+x = 1
+def f():
+    """doc"""
+    return 1
@@ -0,0 +1,12 @@
+# full-line comment
+    # indented comment
+
+x = 1  # inline comment
+s = "# a hash in a string is cut as well, the line stays code"
+	
+# the line above holds a tab only
+y = [
+    1,  # one
+    # two
+    3,
+]
@@ -0,0 +1,20 @@
+"""
+Module docstring over
+three lines.
+"""
+
+
+def plain():
+    """One line docstring."""
+    return 1
+
+
+def prefixed():
+    u"""Prefixed docstring."""
+    '''Single quoted one
+    over two lines.'''
+    return 2
+
+
+TEMPLATE = """first line of a string
+second line""" + "tail"
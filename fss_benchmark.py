@@ -0,0 +1,340 @@
+"""
+Benchmark suite of the analysis on synthetic repositories with the transformers
+layout, generated with git fast-import. It lives outside fss_se_assignment.py, so the
+analysis script does not carry the generator around:
+
+    python fss_benchmark.py [small] [medium] [large] [--reports REPORT ...]
+"""
+from pathlib import Path
+from collections import Counter
+from concurrent import futures
+from datetime import datetime
+from itertools import combinations
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from fss_find_test import build_import_index
+from fss_se_assignment import (CoChangeConsumer, CommitRecord, DefectConsumer, compute_cc_for_all_files,
+                               defects_month_commits, format_mb, git_output, iter_commit_records, measure_all_files,
+                               mine_history, mine_repository, occ_of_files, peak_rss_mb, round_or_none)
+
+
+BENCHMARK_SINCE = datetime(2023, 1, 1)  # the synthetic histories start in January 2023
+BENCHMARK_SCALES = {
+    "small": {"n_commits": 200, "files_per_commit": 4},
+    "medium": {"n_commits": 2000, "files_per_commit": 5},
+    "large": {"n_commits": 10000, "files_per_commit": 6},
+}
+
+
+def synthetic_module_source(module, version):
+    # some functions with branches, so there is complexity to measure; version changes the body
+    lines = [f'"""Synthetic module {module}."""', "", "import os", ""]
+    for k in range(2 + version % 5):
+        lines += [
+            f"def {module.rpartition('.')[2]}_f{k}(x, y={version}):",
+            "    # branchy body",
+            "    total = 0",
+            f"    for i in range(x + {k}):",
+            f"        if i % {k + 2} == 0 and y:",
+            "            total += i",
+            "        elif i > y:",
+            "            total -= 1",
+            "    return total",
+            "",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def make_synthetic_repo(path, n_commits=1000, files_per_commit=5, fix_rate=0.3, n_modules=None,
+                        n_packages=10, test_rate=0.5, seed=0):
+    """
+    Generate a git repository with the transformers layout: src/synth/pkgN/modM.py and
+    tests/pkgN/test_modM.py (importing its module). Every commit rewrites files_per_commit
+    modules, and with probability test_rate each one's test; fix_rate of the messages
+    contain a fix keyword. The history is written in one go with git fast-import.
+    """
+    rng = np.random.default_rng(seed)
+    path = Path(path)
+    n_modules = n_modules or max(50, n_commits // 4)
+    modules = [f"synth.pkg{i % n_packages}.mod{i}" for i in range(n_modules)]
+    versions = [0] * n_modules
+
+    def module_path(i):
+        return "src/" + modules[i].replace(".", "/") + ".py"
+
+    def test_path(i):
+        pkg, mod = modules[i].split(".")[1:]
+        return f"tests/{pkg}/test_{mod}.py"
+
+    def data(text):
+        raw = text.encode("utf-8")
+        return b"data %d\n" % len(raw) + raw + b"\n"
+
+    stream = []
+    start = int(datetime(2023, 1, 2).timestamp())
+    for n in range(n_commits):
+        chosen = rng.choice(n_modules, size=min(files_per_commit, n_modules), replace=False)
+        if rng.random() < fix_rate:
+            msg = f"{rng.choice(['Fix', 'fix error in', 'Bug in', 'issue with'])} {modules[chosen[0]]}"
+        else:
+            msg = f"Update {modules[chosen[0]]}"
+        stream.append(b"commit refs/heads/main\n")
+        stream.append(b"committer Bench <bench@example.com> %d +0000\n" % (start + n * 3600))
+        stream.append(data(msg))
+        for i in chosen:
+            versions[i] += 1
+            stream.append(f"M 100644 inline {module_path(i)}\n".encode())
+            stream.append(data(synthetic_module_source(modules[i], versions[i])))
+            if versions[i] == 1 or rng.random() < test_rate:
+                stream.append(f"M 100644 inline {test_path(i)}\n".encode())
+                stream.append(data(f"from {modules[i]} import {modules[i].rpartition('.')[2]}_f0\n\n\n"
+                                   f"def test_f0():\n    assert {modules[i].rpartition('.')[2]}_f0({versions[i]}) is not None\n"))
+
+    path.mkdir(parents=True, exist_ok=True)
+    subprocess.run(["git", "init", "-q", str(path)], check=True)
+    subprocess.run(["git", "-C", str(path), "fast-import", "--quiet"], input=b"".join(stream), check=True)
+    subprocess.run(["git", "-C", str(path), "symbolic-ref", "HEAD", "refs/heads/main"], check=True)
+    subprocess.run(["git", "-C", str(path), "reset", "-q", "--hard"], check=True)
+    return path
+
+
+def benchmark_history_backends(repo_path, since=BENCHMARK_SINCE):
+    """
+    Throughput (commits/second) of the pydriller traversal vs. the git log backend,
+    both uncached, and a check that they produce the same per-month and per-file counts.
+    """
+    results = {}
+    for backend in ("pydriller", "git"):
+        start = time.perf_counter()
+        records = list(iter_commit_records(repo_path, since, cache_path=None, backend=backend))
+        elapsed = time.perf_counter() - start
+
+        defects, co_change = DefectConsumer(), CoChangeConsumer()
+        for record in records:
+            defects.consume(record)
+            co_change.consume(record)
+
+        results[backend] = {
+            "commits": len(records),
+            "seconds": elapsed,
+            "commits_per_sec": len(records) / elapsed if elapsed else float("inf"),
+            "defects_per_month": dict(defects.defects_per_month),
+            "defects_per_file": dict(occ_of_files(defects.defective_commits)),
+            "commits_per_file": dict(co_change.file_count),
+        }
+        print(f"{backend:>9}: {len(records)} commits in {elapsed:.2f}s ({results[backend]['commits_per_sec']:.1f} commits/s)")
+
+    identical = all(
+        results["pydriller"][key] == results["git"][key]
+        for key in ("commits", "defects_per_month", "defects_per_file", "commits_per_file")
+    )
+    print(f"Identical per-month and per-file counts: {identical}")
+    print(f"Speedup: {results['pydriller']['seconds'] / max(results['git']['seconds'], 1e-9):.1f}x")
+    # the counts themselves are only compared, not stored
+    summary = {backend: {key: round(result[key], 4) for key in ("commits", "seconds", "commits_per_sec")}
+               for backend, result in results.items()}
+    return {**summary, "identical": identical}
+
+
+
+def report_mining_scaling(repo_path, since=BENCHMARK_SINCE, backend="git", max_workers=None):
+    """
+    Time uncached mining with 1, 2, 4, ... workers up to max_workers (default: core count)
+    and check that every run merges to the serial result.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    counts = sorted({min(2 ** i, max_workers) for i in range(max_workers.bit_length() + 1)})
+
+    report = []
+    serial = None
+    for workers in counts:
+        start = time.perf_counter()
+        defects, co_change = mine_repository(repo_path, since, cache_path=None, backend=backend, workers=workers)
+        elapsed = time.perf_counter() - start
+
+        result = (list(defects.defects_per_month.items()), defects.defective_commits,
+                  list(co_change.file_count.items()), co_change.pair_items())
+        serial = serial or (result, elapsed)
+        report.append({
+            "workers": workers,
+            "seconds": elapsed,
+            "speedup": serial[1] / elapsed if elapsed else float("inf"),
+            "matches_serial": result == serial[0],
+        })
+
+    print("workers  seconds  speedup  matches serial")
+    for row in report:
+        print(f"{row['workers']:>7}  {row['seconds']:>7.2f}  {row['speedup']:>6.2f}x  {row['matches_serial']}")
+    return report
+
+
+def report_cc_scan_timing(repo_root, workers=None, cache_path=".fss_cc_timing.sqlite"):
+    """Time a cold (empty cache) and a warm (everything cached) scan."""
+    if os.path.exists(cache_path):
+        os.remove(cache_path)
+
+    timings = {}
+    results = {}
+    for run in ("cold", "warm"):
+        start = time.perf_counter()
+        results[run] = measure_all_files(repo_root, workers=workers, cache_path=cache_path)
+        timings[run] = time.perf_counter() - start
+        print(f"{run}: {len(results[run])} files in {timings[run]:.2f}s")
+
+    os.remove(cache_path)
+    identical = results["cold"].equals(results["warm"])
+    print(f"Warm run is {timings['cold'] / max(timings['warm'], 1e-9):.1f}x faster, identical results: {identical}")
+    return {**{run: round(seconds, 4) for run, seconds in timings.items()}, "identical": identical}
+
+
+def co_change_history(repo_path, since=BENCHMARK_SINCE, mass_refactor_files=2000):
+    # the repository's commits plus one mass refactor touching up to mass_refactor_files of its files
+    records = list(iter_commit_records(repo_path, since, cache_path=None))
+    paths = tuple(dict.fromkeys(path for record in records for path in record.paths))[:mass_refactor_files]
+    refactor = CommitRecord("refactor", records[-1].committer_date, "", False, paths, "", ((1, 1),) * len(paths))
+    return records + [refactor]
+
+
+def co_change_peak_rss(engine, repo_path, since):
+    # runs in a fresh worker process; peak RSS in MB after counting the history
+    history = co_change_history(repo_path, since)
+    if engine == "baseline":
+        n_pairs = 0
+    elif engine == "counter":
+        file_count, pair_count = Counter(), Counter()
+        for commit in history:
+            file_count.update(commit.paths)
+            for f1, f2 in combinations(sorted(commit.paths), 2):
+                pair_count[(f1, f2)] += 1
+        n_pairs = len(pair_count)
+    else:
+        consumer = CoChangeConsumer()
+        for commit in history:
+            consumer.consume(commit)
+        n_pairs = consumer.n_pairs
+    # VmHWM where there is one: ru_maxrss keeps the peak of the parent across fork and exec
+    return n_pairs, peak_rss_mb()
+
+
+def report_co_change_memory(repo_path, since=BENCHMARK_SINCE):
+    """
+    Peak RSS of the old tuple-key Counter vs. the array-backed CoChangeConsumer over the
+    history plus a mass refactor (co_change_history); baseline: the history alone.
+    """
+    report = {}
+    for engine in ("baseline", "counter", "arrays"):
+        # a fresh interpreter each, so the peak is not inherited from this process
+        with futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            n_pairs, peak = pool.submit(co_change_peak_rss, engine, repo_path, since).result()
+        report[engine] = {"pairs": n_pairs, "peak_rss_mb": round_or_none(peak, 1)}
+        print(f"{engine:>8}: {n_pairs} pairs, peak RSS {format_mb(peak)}")
+    return report
+
+
+# reports run per scale on request (--reports), called with the repository and the since date
+BENCHMARK_REPORTS = {
+    "backends": benchmark_history_backends,
+    "scaling": report_mining_scaling,
+    "cc-scan": lambda repo_path, since: report_cc_scan_timing(repo_path),
+    "co-change-memory": report_co_change_memory,
+}
+
+
+def run_benchmarks(scales=("small", "medium"), results_path="benchmarks.jsonl", repos_dir=".fss_bench", reports=()):
+    """
+    Time defects_month_commits, the co-change extraction, compute_cc_for_all_files and
+    build_import_index (all uncached) on synthetic repositories of the given
+    BENCHMARK_SCALES, plus the given BENCHMARK_REPORTS. Repositories are generated once
+    into repos_dir and reused. Every run appends its results to results_path and is
+    compared with the previous run of the same scale.
+    """
+    try:
+        tool_commit = git_output(Path(__file__).resolve().parent, "rev-parse", "--short", "HEAD").strip()
+    except (subprocess.CalledProcessError, OSError):
+        tool_commit = None
+
+    previous = {}
+    if os.path.exists(results_path):
+        with open(results_path, encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                previous[(entry["scale"], json.dumps(entry["params"], sort_keys=True))] = entry
+
+    results = []
+    for scale in scales:
+        params = BENCHMARK_SCALES[scale]
+        key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:8]
+        repo = Path(repos_dir) / f"{scale}-{key}"
+        if not (repo / ".git").is_dir():
+            start = time.perf_counter()
+            make_synthetic_repo(repo, **params)
+            print(f"Generated {scale} repository in {time.perf_counter() - start:.2f}s")
+
+        timings, sizes = {}, {}
+        since = BENCHMARK_SINCE
+
+        start = time.perf_counter()
+        defects_per_month, defective_commits = defects_month_commits(str(repo), since, cache_path=None)
+        timings["defects_month_commits"] = time.perf_counter() - start
+        sizes["defective_commits"] = len(defective_commits)
+
+        start = time.perf_counter()
+        co_change, = mine_history([CoChangeConsumer()], str(repo), since, cache_path=None)
+        sizes["pairs"] = co_change.n_pairs
+        timings["co_change"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cc = compute_cc_for_all_files(repo, cache_path=None)
+        timings["compute_cc_for_all_files"] = time.perf_counter() - start
+        sizes["files"] = len(cc)
+
+        start = time.perf_counter()
+        index = build_import_index(repo, cache_path=None)
+        timings["build_import_index"] = time.perf_counter() - start
+        sizes["imported_names"] = len(index.names)
+
+        entry = {"timestamp": datetime.now().isoformat(timespec="seconds"), "tool_commit": tool_commit,
+                 "python": sys.version.split()[0], "scale": scale, "params": params,
+                 "sizes": sizes, "seconds": {name: round(t, 4) for name, t in timings.items()}}
+        for name in reports:
+            print(f"\n{scale} {name}:")
+            entry.setdefault("reports", {})[name] = BENCHMARK_REPORTS[name](str(repo), since)
+        results.append(entry)
+
+        before = previous.get((scale, json.dumps(params, sort_keys=True)))
+        print(f"\n{scale}: {params}, {sizes}")
+        for name, seconds in entry["seconds"].items():
+            change = ""
+            if before is not None and before["seconds"].get(name):
+                change = f"  ({before['seconds'][name] / max(seconds, 1e-9):.2f}x vs. {before['tool_commit']})"
+            print(f"  {name:>26}: {seconds:8.3f}s{change}")
+
+    with open(results_path, "a", encoding="utf-8") as f:
+        for entry in results:
+            f.write(json.dumps(entry) + "\n")
+    print(f"\nBenchmark results appended to {results_path}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the benchmark suite on synthetic repositories.")
+    parser.add_argument("scales", nargs="*", choices=list(BENCHMARK_SCALES), metavar="SCALE",
+                        help=f"repository sizes to run ({', '.join(BENCHMARK_SCALES)}; default: small medium)")
+    parser.add_argument("--reports", nargs="+", choices=list(BENCHMARK_REPORTS), default=[], metavar="REPORT",
+                        help=f"also run these reports on every scale ({', '.join(BENCHMARK_REPORTS)})")
+    args = parser.parse_args(argv)
+    run_benchmarks(args.scales or ("small", "medium"), reports=args.reports)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
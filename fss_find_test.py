@@ -0,0 +1,291 @@
+"""
+Task 3.4 test lookup on its own: the test file mirroring a source file and the
+test files importing it. It does not load fss_se_assignment.py (or pandas), so a
+git hook or an editor can call it on every change:
+
+    python fss_find_test.py src/transformers/generation/utils.py [--imports] [--repo PATH]
+"""
+from pathlib import Path
+from collections import defaultdict
+from contextlib import closing
+from bisect import bisect_left
+from typing import Dict, Set
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+# parsed test imports, kept outside the analysed repository so lookups leave no files in it
+IMPORT_CACHE_PATH = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "fss_se_assignment" / "imports.sqlite"
+
+
+def git_blob_sha(data):
+    # the hash git gives the file's content, so an unchanged file keeps its key across runs and checkouts
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def mirror_structure(rel_src: Path) -> Path:
+    """
+    Mirror the structure exactly:
+    src/.../name.py  ->  tests/.../test_name.py
+    """
+    parts = list(rel_src.parts)
+
+    if not parts or parts[0] != "src":
+        raise ValueError(f"Expected path starting with 'src/', got: {rel_src}")
+
+    parts[0] = "tests"
+    filename = parts[-1]
+    stem = Path(filename).stem
+    new_filename = f"test_{stem}.py"
+    parts[-1] = new_filename
+
+    return Path(*parts)
+
+
+def find_repo_root(start: Path) -> Path:
+    current = start.resolve()
+    for parent in [current] + list(current.parents):
+        if (parent / ".git").is_dir():
+            return parent
+    raise RuntimeError(f"Could not find .git directory above {start}")
+
+
+def compute_module_name(rel_src: Path) -> str:
+    """
+    Compute a Python module name from a repo-relative source path.
+    Example: src/transformers/data/processors/squad.py -> transformers.data.processors.squad
+    """
+    parts = list(rel_src.parts)
+
+    if not parts or parts[0] != "src":
+        raise ValueError(f"Source file must be under src/, got: {rel_src}")
+
+    # drop "src"
+    parts = parts[1:]
+
+    # remove .py
+    if parts[-1].endswith(".py"):
+        parts[-1] = parts[-1][:-3]
+
+    if not parts:
+        raise ValueError(f"Cannot compute module name from path: {rel_src}")
+
+    return ".".join(parts)
+
+
+def rank_tests(tests):
+    # closest test first: shallowest path, then alphabetical
+    return sorted(tests, key=lambda p: (len(p.parts), str(p)))
+
+
+def parse_imports(text, filename, package=None):
+    """
+    Module names a file imports, plus module.symbol for every from-import.
+    With package (the package the file belongs to) relative imports are resolved,
+    otherwise they are kept as written without the dots.
+    """
+    import ast  # only needed when a file has to be parsed
+
+    tree = ast.parse(text, filename=filename)
+    imports = set()
+
+    # go through files and collect imports
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            # e.g. "import transformers.data.processors.squad as squad_mod"
+            for alias in node.names:
+                imports.add(alias.name)  # "transformers.data.processors.squad"
+
+        elif isinstance(node, ast.ImportFrom):
+            # e.g. "from transformers.data.processors.squad import SquadExample"
+            mod = node.module  # "transformers.data.processors.squad"
+            if node.level and package is not None:
+                # e.g. "from ..utils import logging" inside transformers.models.bert
+                base = package.split(".")[:len(package.split(".")) - node.level + 1]
+                mod = ".".join(base + ([mod] if mod else []))
+            if not mod:
+                continue
+
+            imports.add(mod)
+            # Also index full name including imported symbol
+            for alias in node.names:
+                imports.add(f"{mod}.{alias.name}")  # "transformers.data.processors.squad.SquadExample"
+
+    return sorted(imports)
+
+
+class ImportIndex:
+    """
+    Imported module name -> test files importing it. The names are kept sorted,
+    so all names below a module (module.symbol, module.sub) are one bisect away.
+    """
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self.names = sorted(mapping)
+
+    def get(self, name, default=frozenset()):
+        return self.mapping.get(name, default)
+
+    def with_prefix(self, prefix):
+        # the names starting with prefix form one contiguous run of the sorted list
+        i = bisect_left(self.names, prefix)
+        tests = set()
+        while i < len(self.names) and self.names[i].startswith(prefix):
+            tests |= self.mapping[self.names[i]]
+            i += 1
+        return tests
+
+    def tests_for(self, module_name):
+        """Tests importing module_name itself, otherwise tests importing anything from it."""
+        return self.get(module_name) or self.with_prefix(module_name + ".")
+
+
+def open_import_index(cache_path=IMPORT_CACHE_PATH):
+    import sqlite3
+
+    if cache_path is not None:
+        Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(cache_path if cache_path is not None else ":memory:", timeout=60)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS file_imports (
+            root TEXT, path TEXT, mtime_ns INTEGER, size INTEGER, blob TEXT, imports TEXT,
+            PRIMARY KEY (root, path)
+        )
+    """)
+    return conn
+
+
+def package_of(rel_src):
+    # package a src/ file belongs to, for resolving its relative imports
+    module = compute_module_name(rel_src)
+    return module[:-len(".__init__")] if module.endswith(".__init__") else module.rpartition(".")[0]
+
+
+def scan_imports(repo_root, subdir, pattern, cache_path=IMPORT_CACHE_PATH, resolve_relative=False):
+    """
+    {repo-relative path: imported names} of the files matching pattern below subdir.
+    Parsed imports are stored in the cache per file; a file is only read again if its
+    mtime or size changed, and only parsed again if its content (blob hash) changed.
+    Files that cannot be read or parsed are reported and have no imports.
+    """
+    repo_root = Path(repo_root).resolve()
+    imports = {}
+
+    with closing(open_import_index(cache_path)) as conn:
+        cached = {path: row for path, *row in conn.execute(
+            "SELECT path, mtime_ns, size, blob, imports FROM file_imports WHERE root = ? AND path LIKE ?",
+            (str(repo_root), f"{subdir}/%"))}
+        updates = []
+
+        for file_path in (repo_root / subdir).rglob(pattern):
+            rel_path = file_path.relative_to(repo_root).as_posix()
+            try:
+                stat = file_path.stat()
+            except OSError as e:
+                print(f"[WARN] Could not read {rel_path}: {e}", file=sys.stderr)
+                continue
+
+            row = cached.get(rel_path)
+            if row is None or (row[0], row[1]) != (stat.st_mtime_ns, stat.st_size):
+                try:
+                    data = file_path.read_bytes()
+                except OSError as e:
+                    print(f"[WARN] Could not read {rel_path}: {e}", file=sys.stderr)
+                    continue
+
+                blob = git_blob_sha(data)
+                if row is not None and row[2] == blob:
+                    names = row[3]  # touched but unchanged
+                else:
+                    package = package_of(Path(rel_path)) if resolve_relative else None
+                    try:
+                        names = json.dumps(parse_imports(data.decode("utf-8"), str(file_path), package))
+                    except UnicodeDecodeError as e:
+                        print(f"[WARN] Could not read {rel_path}: {e}", file=sys.stderr)
+                        names = "[]"
+                    except SyntaxError as e:
+                        print(f"[WARN] Syntax error in {rel_path}: {e}", file=sys.stderr)
+                        names = "[]"
+                row = (stat.st_mtime_ns, stat.st_size, blob, names)
+                updates.append((str(repo_root), rel_path, *row))
+
+            imports[rel_path] = json.loads(row[3])
+
+        gone = [(str(repo_root), path) for path in cached if path not in imports]
+        if updates or gone:
+            conn.executemany("INSERT OR REPLACE INTO file_imports VALUES (?, ?, ?, ?, ?, ?)", updates)
+            conn.executemany("DELETE FROM file_imports WHERE root = ? AND path = ?", gone)
+            conn.commit()
+
+    return imports
+
+
+def build_import_index(repo_root, cache_path=IMPORT_CACHE_PATH):
+    """ImportIndex of tests/**/test*.py under repo_root, see scan_imports for the caching."""
+    repo_root = Path(repo_root).resolve()
+    mapping: Dict[str, Set[Path]] = defaultdict(set)
+
+    if not (repo_root / "tests").is_dir():
+        print(f"[WARN] No tests/ directory found under {repo_root}", file=sys.stderr)
+        return ImportIndex(mapping)
+
+    for rel_test, names in scan_imports(repo_root, "tests", "test*.py", cache_path).items():
+        for name in names:
+            mapping[name].add(Path(rel_test))
+    return ImportIndex(mapping)
+
+
+def find_test_by_imports(src_file: Path, cache_path=IMPORT_CACHE_PATH) -> Path:
+    """
+    Input: a non-test source file, find the most related test file
+    """
+    if not src_file.is_file():
+        raise FileNotFoundError(f"Source file does not exist: {src_file}")
+
+    repo_root = find_repo_root(src_file)
+    try:
+        rel_src = src_file.resolve().relative_to(repo_root)
+    except ValueError:
+        raise RuntimeError(f"{src_file} is not inside repo root {repo_root}")
+
+    module_name = compute_module_name(rel_src)
+    print(f"[INPUT] Source file: {rel_src}")
+
+    import_index = build_import_index(repo_root, cache_path)
+    # otherwise entries where module_name is a prefix:
+    # e.g. module_name = transformers.data.processors.squad
+    # and index key = transformers.data.processors.squad.SquadExample
+    direct_tests = import_index.tests_for(module_name)
+
+    if not direct_tests:
+        raise RuntimeError(f"No test file imports module '{module_name}' (or its symbols).")
+
+    return rank_tests(direct_tests)[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print the test file of a source file (Task 3.4).")
+    parser.add_argument("source", help="repository-relative source file, e.g. src/transformers/generation/utils.py")
+    parser.add_argument("--imports", action="store_true",
+                        help="also find the test importing the module (scans the tests, cached in "
+                             f"{IMPORT_CACHE_PATH})")
+    parser.add_argument("--repo", help="path of the analysed repository "
+                                       "(default: the git repository of the current directory)")
+    args = parser.parse_args(argv)
+
+    try:
+        print(mirror_structure(Path(args.source)))
+        if args.imports:
+            repo_root = Path(args.repo) if args.repo else find_repo_root(Path.cwd())
+            print(f"[RESULT] {find_test_by_imports(repo_root / args.source)}")
+    except (ValueError, RuntimeError, OSError) as e:
+        print(f"[ERROR] {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,62 +1,1062 @@
 from pathlib import Path
-import pandas as pd
+import importlib
 import subprocess
 import csv
-import matplotlib.pyplot as plot
-from radon.complexity import cc_visit
-import pydriller as pyd
 from collections import defaultdict
-import matplotlib.pyplot as plt
 import re
 import os
 from datetime import datetime
-from itertools import combinations
-from collections import Counter
-from pydriller import Repository
-import ast
+from itertools import accumulate, repeat
+from collections import Counter, namedtuple
 import sys
-from typing import Dict, Set
+import json
+import sqlite3
+import time
+import hashlib
+from contextlib import closing, contextmanager
+import argparse
+import glob
+from bisect import bisect_right
+
+from fss_find_test import (build_import_index, compute_module_name, find_repo_root, find_test_by_imports,
+                           git_blob_sha, main as find_test_main, mirror_structure, rank_tests, scan_imports)
+
+
+class LazyModule:
+    """
+    Stands in for a heavy module under its global alias and imports it on first use,
+    then replaces itself with the module, so e.g. find-test never loads pandas.
+    """
+
+    def __init__(self, name, alias):
+        self.name = name
+        self.alias = alias
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.name)
+        globals()[self.alias] = module
+        return getattr(module, attr)
+
+
+pd = LazyModule("pandas", "pd")
+np = LazyModule("numpy", "np")
+plt = LazyModule("matplotlib.pyplot", "plt")
+radon_complexity = LazyModule("radon.complexity", "radon_complexity")
+pyd = LazyModule("pydriller", "pyd")
+nx = LazyModule("networkx", "nx")
+futures = LazyModule("concurrent.futures", "futures")
 
 """
 RUN THIS FILE OUTSIDE transformers REPOSITORY (on the same height).
 """
 
 
-# regex pattern
-pattern = re.compile(r"\b(bug|fix|error|issue)\b", re.IGNORECASE)
+# defect keywords (whole words, any case) and the issue references --issue-refs adds, e.g. "Closes #1234".
+# Only references after a closing keyword count: the "(#1234)" ending squash-merge titles is the PR number
+DEFECT_KEYWORDS = ("bug", "fix", "error", "issue")
+ISSUE_REFERENCES = (r"\b(fix(e[sd])?|close[sd]?|resolve[sd]?)\s+#\d+",)
+# squash merges list the merged commits as "* message" items; trailers ("Co-authored-by: ...") are no messages
+SQUASH_ITEM = re.compile(r"^\* ", re.MULTILINE)
+TRAILER = re.compile(r"^[A-Za-z-]+-by: .*$", re.MULTILINE)
+
+
+class DefectClassifier:
+    """
+    Keywords and issue reference patterns compiled into one regex. count() gives the
+    number of defect messages in a commit message: 0 or 1, or with split_squashed the
+    number of matching "* " items of a squashed commit (at least 1 if its title matches).
+    classify() scans many messages at once: they are joined into one text which the
+    regex searches, jumping to the next message after each hit.
+    """
+
+    def __init__(self, keywords=DEFECT_KEYWORDS, references=(), split_squashed=False):
+        self.keywords, self.references = tuple(keywords), tuple(references)
+        alternatives = [rf"\b({'|'.join(re.escape(k) for k in keywords)})\b"] + list(references)
+        self.regex = re.compile("|".join(alternatives), re.IGNORECASE)
+        self.split_squashed = split_squashed
+        self.key = f"{self.regex.pattern}/{self.regex.flags}" + ("/split" if split_squashed else "")
+
+    def sub_messages(self, msg):
+        # the title (or the whole message) followed by the squashed items
+        if not self.split_squashed:
+            return [msg]
+        title, *items = SQUASH_ITEM.split(TRAILER.sub("", msg))
+        return [title if items else msg] + [item for item in items if item.strip()]
+
+    @staticmethod
+    def _total(hits):
+        title, *items = hits
+        return sum(items) or title
+
+    def count(self, msg):
+        return self._total([int(bool(self.regex.search(sub_msg))) for sub_msg in self.sub_messages(msg)])
+
+    def classify(self, msgs):
+        hits, texts = [], []
+        for msg in msgs:
+            sub_msgs = self.sub_messages(msg)
+            hits.append([0] * len(sub_msgs))
+            texts.extend(sub_msgs)
+        owners = [(i, j) for i, msg_hits in enumerate(hits) for j in range(len(msg_hits))]
+        if not texts:
+            return []
+
+        # NUL never occurs in a message, so no match spans two of them
+        starts = list(accumulate((len(text) + 1 for text in texts[:-1]), initial=0))
+        text = "\0".join(texts)
+        pos = 0
+        while True:
+            match = self.regex.search(text, pos)
+            if match is None:
+                break
+            i = bisect_right(starts, match.start()) - 1
+            msg, sub_msg = owners[i]
+            hits[msg][sub_msg] = 1
+            if i + 1 == len(starts):
+                break
+            pos = starts[i + 1]
+        return [self._total(msg_hits) for msg_hits in hits]
+
+
+DEFECT_CLASSIFIER = DefectClassifier()
+
+REPO_PATH = "./transformers"
+SINCE_DATE = datetime(2023, 1, 1)
+CACHE_PATH = ".fss_cache.sqlite"
+HISTORY_BACKEND = "git"  # "git" (one log --numstat stream, fast) or "pydriller"
+COLUMNAR_FORMAT = None  # "parquet" or "feather" (needs pyarrow): also write each table in that format
+TABLE_CHUNK_ROWS = 200_000
+DEFECT_DTYPES = {"file": str, "defects": "int64"}
+CHURN_RECENT_MONTHS = 6  # window of the "recent" ownership, in months up to the newest one mined
+CHURN_DTYPES = {"file": str, "lines_added": "int64", "lines_deleted": "int64", "churn": "int64", "authors": "int64",
+                "ownership": "float64", "recent_ownership": "float64"}
+
+# lightweight view of a commit, only the fields the tasks need (and no diffs kept around);
+# is_defect is the number of defect messages (DefectClassifier.count), churn the (added, deleted) lines of every path
+CommitRecord = namedtuple("CommitRecord", ["hash", "committer_date", "msg", "is_defect", "paths", "author", "churn"])
+
+
+def make_commit_record(sha, committer_date, msg, modified_paths, author="", line_counts=None):
+    churn = {}
+    for path, (added, deleted) in zip(modified_paths, line_counts or repeat((0, 0))):
+        if path and path.endswith(".py"):
+            total_added, total_deleted = churn.get(path, (0, 0))
+            churn[path] = (total_added + added, total_deleted + deleted)
+    is_defect = DEFECT_CLASSIFIER.count(msg)
+    return CommitRecord(sha, committer_date, msg, is_defect, tuple(churn), author, tuple(churn.values()))
+
+
+def to_commit_record(commit):
+    # we use path vs filename otherwise in dict we would count same filename but different path as same
+    modified_paths = [m.new_path or m.old_path for m in commit.modified_files]
+    line_counts = [(m.added_lines, m.deleted_lines) for m in commit.modified_files]
+    return make_commit_record(commit.hash, commit.committer_date, commit.msg, modified_paths, commit.author.name,
+                              line_counts)
+
+
+def git_output(repo_path, *args):
+    return subprocess.run(["git", "-C", str(repo_path), *args], check=True, capture_output=True, text=True).stdout
+
+
+def list_commit_shas(repo_path=REPO_PATH, since=SINCE_DATE):
+    # same commits and order as pydriller's traversal (it runs "git rev-list --reverse --since=... HEAD" too)
+    return git_output(repo_path, "rev-list", "--reverse", f"--since={since}", "HEAD").split()
+
+
+def list_commit_timestamps(repo_path=REPO_PATH, since=SINCE_DATE):
+    # committer timestamps in the same order as list_commit_shas
+    out = git_output(repo_path, "log", "--reverse", f"--since={since}", "--format=%ct", "HEAD")
+    return [int(t) for t in out.split()]
+
+
+def split_commit_range(shas, n_slices, timestamps=None):
+    """
+    Split the ordered commit list into at most n_slices contiguous slices,
+    either with the same number of commits each or (with timestamps) covering
+    equally long time spans.
+    """
+    if not shas:
+        return []
+
+    n_slices = max(1, min(n_slices, len(shas)))
+    if timestamps is None:
+        bounds = [round(i * len(shas) / n_slices) for i in range(n_slices + 1)]
+    else:
+        # commit order is not strictly chronological, cut where the running max passes each time step
+        running_max, current = [], float("-inf")
+        for t in timestamps:
+            current = max(current, t)
+            running_max.append(current)
+        start, end = min(timestamps), running_max[-1]
+        steps = [start + i * (end - start) / n_slices for i in range(1, n_slices)]
+        bounds = [0] + [next((j for j, t in enumerate(running_max) if t >= step), len(shas)) for step in steps] + [len(shas)]
+    return [shas[a:b] for a, b in zip(bounds, bounds[1:]) if a < b]
+
+
+# one record per commit: \x1e hash \0 committer date \0 author \0 message \0, followed by the -z numstat entries.
+# The author name as recorded (%an, not the .mailmap name %aN), as pydriller reports it
+GIT_LOG_FORMAT = "%x1e%H%x00%cI%x00%an%x00%B%x00"
+
+
+def parse_git_log_entry(entry):
+    sha, committer_date, author, msg, status = entry.decode("utf-8", errors="replace").split("\0", 4)
+    tokens = status.lstrip("\0\n").split("\0")
+
+    modified_paths, line_counts = [], []
+    i = 0
+    while i < len(tokens) and tokens[i]:
+        added, deleted, path = tokens[i].split("\t", 2)
+        if path:
+            i += 1
+        else:
+            # renames list old and new path in the next two entries, pydriller reports the new one
+            path = tokens[i + 2]
+            i += 3
+        modified_paths.append(path)
+        # binary files have "-" instead of line counts
+        line_counts.append((int(added) if added != "-" else 0, int(deleted) if deleted != "-" else 0))
+
+    return make_commit_record(sha, datetime.fromisoformat(committer_date), msg.strip(), modified_paths, author,
+                              line_counts)
+
+
+def iter_git_log_records(repo_path=REPO_PATH, since=SINCE_DATE, shas=None):
+    """
+    Git history backend: hash, committer date, author, message and the modified
+    paths with their added/deleted line counts are read from one
+    "git log --numstat -z" stream, no patches are generated or kept.
+    Yields the same records (and order) as the pydriller traversal. If `shas` is
+    given only those commits are listed, in the given order.
+    """
+    # same diff settings as pydriller/GitPython: first parent only, no files for merges, rename detection
+    cmd = ["git", "-C", str(repo_path), "log", "-M", "--root", "--numstat", "-z",
+           "--no-show-signature", f"--format={GIT_LOG_FORMAT}"]
+    if shas is None:
+        cmd += ["--reverse", f"--since={since}", "HEAD"]
+    elif not shas:
+        # git log --stdin without revisions falls back to HEAD
+        return
+    else:
+        cmd += ["--no-walk=unsorted", "--stdin"]
+
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    # git reads all revisions from stdin before it starts writing the log
+    proc.stdin.write("".join(f"{sha}\n" for sha in shas or []).encode())
+    proc.stdin.close()
+
+    buffer = b""
+    for block in iter(lambda: proc.stdout.read(1 << 16), b""):
+        buffer += block
+        *entries, buffer = buffer.split(b"\x1e")
+        for entry in entries:
+            if entry:
+                yield parse_git_log_entry(entry)
+    if buffer:
+        yield parse_git_log_entry(buffer)
+
+    if proc.wait() != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+def open_commit_cache(cache_path=CACHE_PATH):
+    # parallel mining workers share the cache file, wait for each other's writes
+    conn = sqlite3.connect(cache_path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS commits (
+            sha TEXT PRIMARY KEY,
+            committer_date TEXT NOT NULL,
+            msg TEXT NOT NULL,
+            is_defect INTEGER NOT NULL,
+            paths TEXT NOT NULL,
+            author TEXT,
+            churn TEXT
+        );
+    """)
+    # caches from before churn was mined: add the columns, their commits are mined again (churn is NULL)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(commits)")}
+    for column in ("author", "churn"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE commits ADD COLUMN {column} TEXT")
+
+    # authors used to be mined with .mailmap applied by the git backend: mine those commits again
+    if conn.execute("SELECT value FROM meta WHERE key = 'authors'").fetchone() is None:
+        conn.execute("UPDATE commits SET churn = NULL")
+        conn.execute("INSERT INTO meta VALUES ('authors', 'recorded')")
+        conn.commit()
+
+    # if the classifier changed we re-classify the cached messages instead of re-mining them
+    row = conn.execute("SELECT value FROM meta WHERE key = 'pattern'").fetchone()
+    if row is None or row[0] != DEFECT_CLASSIFIER.key:
+        rows = conn.execute("SELECT sha, msg FROM commits").fetchall()
+        counts = DEFECT_CLASSIFIER.classify([msg for _, msg in rows])
+        conn.executemany("UPDATE commits SET is_defect = ? WHERE sha = ?", zip(counts, (sha for sha, _ in rows)))
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('pattern', ?)", (DEFECT_CLASSIFIER.key,))
+        conn.commit()
+
+    return conn
+
+
+def load_cached_records(conn, shas):
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (sha TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM wanted")
+    conn.executemany("INSERT OR IGNORE INTO wanted VALUES (?)", ((sha,) for sha in shas))
+    # end the implicit transaction, otherwise concurrent workers deadlock when they write new commits
+    conn.commit()
+
+    records = {}
+    rows = conn.execute("SELECT sha, committer_date, msg, is_defect, paths, author, churn FROM commits "
+                        "JOIN wanted USING (sha) WHERE churn IS NOT NULL")
+    for sha, committer_date, msg, is_defect, paths, author, churn in rows:
+        records[sha] = CommitRecord(sha, datetime.fromisoformat(committer_date), msg, is_defect,
+                                    tuple(json.loads(paths)), author, tuple(map(tuple, json.loads(churn))))
+    return records
+
+
+def store_records(conn, records):
+    conn.executemany(
+        "INSERT OR REPLACE INTO commits (sha, committer_date, msg, is_defect, paths, author, churn) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(r.hash, r.committer_date.isoformat(), r.msg, int(r.is_defect), json.dumps(r.paths), r.author,
+          json.dumps(r.churn)) for r in records],
+    )
+    conn.commit()
+
+
+def traverse_with_pydriller(repo_path, since, shas=None, attempts=50):
+    # pydriller writes .git/config when it opens the repository, parallel workers can collide on its lock file
+    for attempt in range(attempts):
+        commits = pyd.Repository(repo_path, since=since, only_commits=shas).traverse_commits()
+        try:
+            first = next(commits, None)
+        except OSError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.1)
+            continue
+        if first is not None:
+            yield first
+            yield from commits
+        return
+
+
+def mine_commit_records(repo_path=REPO_PATH, since=SINCE_DATE, backend=HISTORY_BACKEND, shas=None):
+    # uncached mining of all commits since `since`, or only of `shas`
+    if backend == "git":
+        yield from iter_git_log_records(repo_path, since, shas)
+    elif backend == "pydriller":
+        for commit in traverse_with_pydriller(repo_path, since, shas):
+            yield to_commit_record(commit)
+    else:
+        raise ValueError(f"Unknown history backend: {backend}")
+
+
+def iter_commit_records(repo_path=REPO_PATH, since=SINCE_DATE, cache_path=CACHE_PATH, backend=HISTORY_BACKEND, shas=None):
+    """
+    Yield a CommitRecord for every commit since `since` (or for `shas`), oldest first.
+    With a cache only commits that are not cached yet are mined,
+    the rest is read back from the cache (keyed by SHA).
+    """
+    if cache_path is None:
+        yield from mine_commit_records(repo_path, since, backend, shas)
+        return
+
+    if shas is None:
+        shas = list_commit_shas(repo_path, since)
+    with closing(open_commit_cache(cache_path)) as conn:
+        records = load_cached_records(conn, shas)
+        missing = [sha for sha in shas if sha not in records]
+        print(f"Commit cache: {len(shas) - len(missing)} cached, {len(missing)} new commits to mine")
+
+        if missing:
+            new_records = list(mine_commit_records(repo_path, since, backend, missing))
+            store_records(conn, new_records)
+            records.update((r.hash, r) for r in new_records)
+
+    for sha in shas:
+        yield records[sha]
+
+
+class DefectConsumer:
+    """Task 1: counts defect commits per month and keeps the defective commits."""
+
+    def __init__(self):
+        self.defects_per_month = defaultdict(int)
+        self.defective_commits = list()
+        self.n_commits = 0
+
+    def spawn(self):
+        # an empty consumer with the same settings, mine_history gives one to every slice
+        return DefectConsumer()
+
+    def consume(self, commit):
+        self.n_commits += 1
+        # commit message matched the defect classifier (split squashed commits count every defect message)
+        if commit.is_defect:
+            self.defective_commits.append(commit)
+            year_month = commit.committer_date.strftime("%Y-%m")
+            self.defects_per_month[year_month] += commit.is_defect
+
+    def merge(self, other):
+        # other holds the commits that come after ours
+        for year_month, count in other.defects_per_month.items():
+            self.defects_per_month[year_month] += count
+        self.defective_commits.extend(other.defective_commits)
+        self.n_commits += other.n_commits
+
+
+class CoChangeConsumer:
+    """
+    Task 3: counts commits per file and commits per pair of files changed together.
+    Files are interned to integer ids and pairs are kept as sorted numpy arrays
+    (key = id1 << 32 | id2, count, index of first occurrence). New pairs are buffered
+    and folded in in batches, so a commit touching thousands of files costs a few
+    arrays instead of millions of tuple keys. Commits with more than max_files files
+    can be skipped ("skip") or down-weighted ("downweight") for the pair counts.
+    """
+
+    FLUSH_SIZE = 1 << 20
+    BLOCK_SIZE = 1 << 16
+
+    def __init__(self, max_files=None, oversized="skip"):
+        if oversized not in ("skip", "downweight"):
+            raise ValueError(f"Unknown handling of oversized commits: {oversized}")
+        self.max_files = max_files
+        self.oversized = oversized
+        self.file_count = Counter()
+        self.file_ids = {}
+        self.paths = []
+        weighted = max_files is not None and oversized == "downweight"
+        self.pair_keys = np.empty(0, dtype=np.int64)
+        self.pair_counts = np.empty(0, dtype=np.float64 if weighted else np.int64)
+        self.pair_first = np.empty(0, dtype=np.int64)
+        self.n_emitted = 0
+        self._buffer = []
+        self._buffered = 0
+
+    def spawn(self):
+        return CoChangeConsumer(self.max_files, self.oversized)
+
+    def intern(self, path):
+        file_id = self.file_ids.get(path)
+        if file_id is None:
+            file_id = self.file_ids[path] = len(self.paths)
+            self.paths.append(path)
+        return file_id
+
+    def consume(self, commit):
+        changed = commit.paths
+        if not changed:
+            return
+
+        for f in changed:
+            self.file_count[f] += 1
+
+        n = len(changed)
+        if n < 2:
+            return
+
+        weight = 1
+        if self.max_files is not None and n > self.max_files:
+            if self.oversized == "skip":
+                return
+            # the commit adds as much pair weight in total as a commit with max_files files
+            weight = self.max_files * (self.max_files - 1) / (n * (n - 1))
+
+        # pairs (i, j > i) of the sorted paths, row by row like combinations(sorted(changed), 2),
+        # generated in blocks of at most BLOCK_SIZE pairs
+        ids = np.array([self.intern(p) for p in sorted(changed)], dtype=np.int64)
+        row_lens = n - 1 - np.arange(n - 1)
+        row_ends = np.cumsum(row_lens)
+        start, done = 0, 0
+        while start < n - 1:
+            end = min(n - 1, max(start + 1, int(np.searchsorted(row_ends, done + self.BLOCK_SIZE, side="right"))))
+            lens = row_lens[start:end]
+            i = np.repeat(np.arange(start, end), lens)
+            j = i + 1 + np.arange(len(i)) - np.repeat(np.cumsum(lens) - lens, lens)
+            self._add((ids[i] << 32) | ids[j], weight)
+            done, start = int(row_ends[end - 1]), end
+
+    def _add(self, keys, counts, first=None):
+        if first is None:
+            first = self.n_emitted + np.arange(len(keys), dtype=np.int64)
+            self.n_emitted += len(keys)
+        self._buffer.append((keys, counts, first))
+        self._buffered += len(keys)
+        if self._buffered >= self.FLUSH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        parts = [(self.pair_keys, self.pair_counts, self.pair_first)] + self._buffer
+        self._buffer, self._buffered = [], 0
+
+        keys = np.concatenate([k for k, _, _ in parts])
+        counts = np.concatenate([np.broadcast_to(np.asarray(c, dtype=self.pair_counts.dtype), k.shape) for k, c, _ in parts])
+        first = np.concatenate([f for _, _, f in parts])
+
+        # group equal keys, keep the earliest occurrence and sum the counts; the parts are
+        # in emission order, so a stable sort on the key alone keeps the earliest one first
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.empty(0, dtype=np.int64)
+        self.pair_keys = keys[starts]
+        del keys
+        self.pair_first = first[order[starts]]
+        del first
+        counts = counts[order]
+        del order
+        self.pair_counts = np.add.reduceat(counts, starts) if len(counts) else counts
+
+    def merge(self, other, weight=1):
+        # other holds the commits that come after ours, its file ids are mapped onto ours;
+        # with a weight its counts are scaled (our counts must be floats then)
+        other._flush()
+        if weight == 1:
+            self.file_count.update(other.file_count)
+        else:
+            self.file_count.update({path: count * weight for path, count in other.file_count.items()})
+        remap = np.array([self.intern(p) for p in other.paths], dtype=np.int64)
+        keys = (remap[other.pair_keys >> 32] << 32) | remap[other.pair_keys & 0xFFFFFFFF]
+        self._add(keys, other.pair_counts if weight == 1 else other.pair_counts * weight,
+                  other.pair_first + self.n_emitted)
+        self.n_emitted += other.n_emitted
+        self._flush()
+
+    @classmethod
+    def from_counts(cls, file_counts, pair_counts, max_files=None, oversized="skip"):
+        # rebuilds the counts of stored rows: (path, commits) and (path1 < path2, commits together)
+        consumer = cls(max_files, oversized)
+        for path, count in file_counts:
+            consumer.intern(path)
+            consumer.file_count[path] = count
+        ids = consumer.file_ids
+        pairs = list(pair_counts)
+        keys = np.array([(ids[a] << 32) | ids[b] for a, b, _ in pairs], dtype=np.int64)
+        consumer._add(keys, np.array([c for _, _, c in pairs], dtype=consumer.pair_counts.dtype))
+        consumer._flush()
+        return consumer
+
+    @property
+    def n_pairs(self):
+        self._flush()
+        return len(self.pair_keys)
+
+    def pairs(self):
+        """File id arrays and counts of all pairs, in the order the pairs were first seen."""
+        self._flush()
+        order = np.argsort(self.pair_first, kind="stable")
+        keys = self.pair_keys[order]
+        return keys >> 32, keys & 0xFFFFFFFF, self.pair_counts[order]
+
+    def pair_items(self):
+        f1, f2, counts = self.pairs()
+        return [(self.paths[a], self.paths[b], c) for a, b, c in zip(f1.tolist(), f2.tolist(), counts.tolist())]
+
+
+class MonthlyCoChangeConsumer:
+    """
+    Co-change counts in per-month buckets (committer date), one CoChangeConsumer each:
+    the counts of any window of months are the merged buckets, decayed counts the
+    buckets merged with weights, so neither needs the history again.
+    """
+
+    def __init__(self, max_files=None, oversized="skip"):
+        self.max_files = max_files
+        self.oversized = oversized
+        self.buckets = {}
+
+    def spawn(self):
+        return MonthlyCoChangeConsumer(self.max_files, self.oversized)
+
+    def bucket(self):
+        # an empty bucket (or window) with the cap of oversized commits
+        return CoChangeConsumer(self.max_files, self.oversized)
+
+    def consume(self, commit):
+        year_month = commit.committer_date.strftime("%Y-%m")
+        if year_month not in self.buckets:
+            self.buckets[year_month] = self.bucket()
+        self.buckets[year_month].consume(commit)
+
+    def merge(self, other):
+        for year_month, bucket in other.buckets.items():
+            if year_month in self.buckets:
+                self.buckets[year_month].merge(bucket)
+            else:
+                self.buckets[year_month] = bucket
+
+    def _months_until(self, end):
+        return [m for m in sorted(self.buckets) if end is None or m <= end]
+
+    def window(self, months=None, end=None):
+        """Counts of the last `months` months up to `end` (default: the newest month; all months without `months`)."""
+        selected = self._months_until(end)
+        if months is not None and selected:
+            # calendar months back from the last one, also when some of them had no commits
+            last = month_index(end or selected[-1])
+            selected = [m for m in selected if month_index(m) > last - months]
+        combined = self.bucket()
+        for year_month in selected:
+            combined.merge(self.buckets[year_month])
+        return combined
+
+    def decayed(self, half_life, end=None):
+        """Counts with every month weighted by 0.5 ** (months before `end` / half_life)."""
+        selected = self._months_until(end)
+        combined = self.bucket()
+        combined.pair_counts = combined.pair_counts.astype(np.float64)
+        if selected:
+            last = month_index(end or selected[-1])
+            for year_month in selected:
+                combined.merge(self.buckets[year_month], 0.5 ** ((last - month_index(year_month)) / half_life))
+        return combined
+
+
+def month_index(year_month):
+    year, month = map(int, year_month.split("-"))
+    return year * 12 + month - 1
+
+
+class FileActivityConsumer:
+    """Commits per file and the date of each file's last change (hotspot signals)."""
+
+    def __init__(self):
+        self.commits = Counter()
+        self.last_change = {}
+
+    def spawn(self):
+        return FileActivityConsumer()
+
+    def consume(self, commit):
+        for path in commit.paths:
+            self.commits[path] += 1
+            if path not in self.last_change or commit.committer_date > self.last_change[path]:
+                self.last_change[path] = commit.committer_date
+
+    def merge(self, other):
+        self.commits.update(other.commits)
+        for path, when in other.last_change.items():
+            if path not in self.last_change or when > self.last_change[path]:
+                self.last_change[path] = when
+
+
+class ChurnConsumer:
+    """
+    Per file and month: lines added, lines deleted, commits and the commits of
+    every author, i.e. code churn and ownership as a compact time series
+    (series[path][month] = [added, deleted, commits], authors[path][month] = Counter).
+    """
+
+    def __init__(self):
+        self.series = defaultdict(dict)
+        self.authors = defaultdict(dict)
+
+    def spawn(self):
+        return ChurnConsumer()
+
+    def consume(self, commit):
+        year_month = commit.committer_date.strftime("%Y-%m")
+        for path, (added, deleted) in zip(commit.paths, commit.churn):
+            row = self.series[path].setdefault(year_month, [0, 0, 0])
+            row[0] += added
+            row[1] += deleted
+            row[2] += 1
+            self.authors[path].setdefault(year_month, Counter())[commit.author] += 1
+
+    def merge(self, other):
+        for path, months in other.series.items():
+            for year_month, (added, deleted, commits) in months.items():
+                row = self.series[path].setdefault(year_month, [0, 0, 0])
+                row[0] += added
+                row[1] += deleted
+                row[2] += commits
+        for path, months in other.authors.items():
+            for year_month, counts in months.items():
+                self.authors[path].setdefault(year_month, Counter()).update(counts)
+
+    def table(self):
+        """One row per file and month."""
+        rows = [(path, year_month, added, deleted, commits, len(self.authors[path][year_month]))
+                for path in sorted(self.series) for year_month, (added, deleted, commits) in sorted(self.series[path].items())]
+        return pd.DataFrame(rows, columns=["file", "month", "lines_added", "lines_deleted", "commits", "authors"])
+
+    def summary(self, recent_months=CHURN_RECENT_MONTHS):
+        """
+        One row per file: total churn, number of distinct authors, ownership (share of
+        the file's commits made by its top author) and the same ownership over the
+        last recent_months months (empty if the file was not changed in that window).
+        """
+        months = {m for per_file in self.series.values() for m in per_file}
+        if months:
+            year, month = map(int, max(months).split("-"))
+            start = year * 12 + month - 1 - (recent_months - 1)
+            recent_start = f"{start // 12:04d}-{start % 12 + 1:02d}"
+        rows = []
+        for path in sorted(self.series):
+            added = sum(row[0] for row in self.series[path].values())
+            deleted = sum(row[1] for row in self.series[path].values())
+            commits, recent = Counter(), Counter()
+            for year_month, counts in self.authors[path].items():
+                commits.update(counts)
+                if year_month >= recent_start:
+                    recent.update(counts)
+            ownership = max(commits.values()) / sum(commits.values())
+            recent_ownership = max(recent.values()) / sum(recent.values()) if recent else np.nan
+            rows.append((path, added, deleted, added + deleted, len(commits), ownership, recent_ownership))
+        return pd.DataFrame(rows, columns=["file", "lines_added", "lines_deleted", "churn", "authors", "ownership",
+                                           "recent_ownership"])
+
+
+def mine_slice(job):
+    # runs in a worker process: mine one slice of commits into the empty consumers of the job
+    global DEFECT_CLASSIFIER
+    consumers, shas, repo_path, since, cache_path, backend, DEFECT_CLASSIFIER = job
+    for commit in iter_commit_records(repo_path, since, cache_path, backend, shas=shas):
+        for consumer in consumers:
+            consumer.consume(commit)
+    return consumers
+
+
+def mine_history(consumers, repo_path=REPO_PATH, since=SINCE_DATE, cache_path=CACHE_PATH, backend=HISTORY_BACKEND,
+                 workers=1, slice_by="commit"):
+    """
+    Walk the commit history once and hand every commit to each consumer,
+    so all tasks share a single (expensive) traversal.
+    With workers > 1 the commit range is split into slices (by "commit" or "date")
+    that are mined in a process pool into empty copies of the consumers (spawn()),
+    the per-slice consumers are merged in order.
+    """
+    if workers > 1:
+        shas = list_commit_shas(repo_path, since)
+        timestamps = list_commit_timestamps(repo_path, since) if slice_by == "date" else None
+        slices = split_commit_range(shas, workers, timestamps)
+
+        if cache_path is not None:
+            # set up the cache (and re-classify messages if needed) once, before the workers use it
+            open_commit_cache(cache_path).close()
+
+        jobs = [([consumer.spawn() for consumer in consumers], chunk, repo_path, since, cache_path, backend,
+                 DEFECT_CLASSIFIER) for chunk in slices]
+        with futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            for i, slice_consumers in enumerate(pool.map(mine_slice, jobs), start=1):
+                for consumer, slice_consumer in zip(consumers, slice_consumers):
+                    consumer.merge(slice_consumer)
+                print(f"Merged slice {i}/{len(slices)} ({len(slices[i - 1])} commits)")
 
-def task1():
-    defects_per_month, defective_commits = defects_month_commits()
+        print("Finished extracting commits.")
+        return consumers
+
+    for i, commit in enumerate(iter_commit_records(repo_path, since, cache_path, backend), start=1):
+        if i % 50 == 0:
+            print(f"Processed {i} commits...")
+        for consumer in consumers:
+            consumer.consume(commit)
+
+    print("Finished extracting commits.")
+    return consumers
+
+
+def mine_repository(repo_path=REPO_PATH, since=SINCE_DATE, cache_path=CACHE_PATH, backend=HISTORY_BACKEND,
+                    workers=1, slice_by="commit"):
+    consumers = [DefectConsumer(), CoChangeConsumer()]
+    defects, co_change = mine_history(consumers, repo_path, since, cache_path, backend, workers, slice_by)
+    return defects, co_change
+
+
+def report_classifier_throughput(classifier=None, repo_path=REPO_PATH, since=SINCE_DATE, cache_path=CACHE_PATH,
+                                 repeat=3):
+    """
+    Messages/second of the defect classifier over the commit messages of the history,
+    one search per message vs. the bulk scan, with and without splitting squashed
+    commits, and the defect counts each way finds.
+    """
+    classifier = classifier or DEFECT_CLASSIFIER
+    msgs = [record.msg for record in iter_commit_records(repo_path, since, cache_path)]
+    variants = [("per message", classifier.split_squashed, False), ("bulk", classifier.split_squashed, True)]
+    variants.append(("bulk, split squashed" if not classifier.split_squashed else "bulk, whole messages",
+                     not classifier.split_squashed, True))
+
+    report = []
+    for name, split_squashed, bulk in variants:
+        variant = DefectClassifier(classifier.keywords, classifier.references, split_squashed)
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            counts = variant.classify(msgs) if bulk else [variant.count(msg) for msg in msgs]
+            best = min(best, time.perf_counter() - start)
+        report.append({"variant": name, "messages": len(msgs), "seconds": best,
+                       "messages_per_sec": len(msgs) / best if best else float("inf"),
+                       "defect_commits": sum(1 for c in counts if c), "defects": sum(counts)})
+
+    print(f"Classifier {classifier.regex.pattern!r} over {len(msgs)} commit messages")
+    print("variant                  msgs/s  defect commits  defects")
+    for row in report:
+        print(f"{row['variant']:<20} {row['messages_per_sec']:>10.0f}  {row['defect_commits']:>14}  {row['defects']:>7}")
+    return report
+
+
+def columnar_path(csv_path, fmt):
+    return Path(csv_path).with_suffix("." + fmt)
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError("Parquet/Feather output needs pyarrow (pip install pyarrow)") from e
+    return pyarrow
+
+
+class TableWriter:
+    """
+    Writes a table chunk by chunk as it is produced: the CSV, plus a Parquet or Feather
+    copy next to it (COLUMNAR_FORMAT) that loads faster. dtypes are applied to every
+    chunk, so all chunks are written the same way.
+    """
+
+    def __init__(self, csv_path, columns, dtypes=None, columnar=None, lineterminator="\n"):
+        self.csv_path = csv_path
+        self.lineterminator = lineterminator
+        self.columns = list(columns)
+        self.dtypes = dtypes or {}
+        self.columnar = COLUMNAR_FORMAT if columnar is None else columnar
+        self.rows = 0
+        self._csv = open(csv_path, "w", newline="", encoding="utf-8")
+        self._header = True
+        self._table_writer = None
+        self._schema = None
+
+    def write(self, chunk):
+        """Append a DataFrame or a list of row tuples."""
+        if not isinstance(chunk, pd.DataFrame):
+            chunk = pd.DataFrame(list(chunk), columns=self.columns)
+        chunk = chunk[self.columns].astype(self.dtypes) if self.dtypes else chunk[self.columns]
+        if len(chunk) == 0 and not self._header:
+            return
+        chunk.to_csv(self._csv, header=self._header, index=False, lineterminator=self.lineterminator)
+        self._header = False
+        self.rows += len(chunk)
+        if self.columnar:
+            self._write_columnar(chunk)
+
+    def _write_columnar(self, chunk):
+        pa = import_pyarrow()
+        if self._table_writer is None:
+            path = columnar_path(self.csv_path, self.columnar)
+            self._schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+            if self.columnar == "parquet":
+                import pyarrow.parquet as pq
+                self._table_writer = pq.ParquetWriter(path, self._schema)
+            elif self.columnar == "feather":
+                # Feather v2 is the Arrow IPC file format, which can be written batch by batch
+                self._table_writer = pa.ipc.new_file(path, self._schema)
+            else:
+                raise ValueError(f"Unknown columnar format: {self.columnar}")
+        self._table_writer.write_table(pa.Table.from_pandas(chunk, schema=self._schema, preserve_index=False))
+
+    def close(self):
+        if self._header:
+            self.write(pd.DataFrame(columns=self.columns))
+        self._csv.close()
+        if self._table_writer is not None:
+            self._table_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_table(df, csv_path, dtypes=None):
+    with TableWriter(csv_path, df.columns, dtypes) as writer:
+        for start in range(0, len(df), TABLE_CHUNK_ROWS):
+            writer.write(df.iloc[start:start + TABLE_CHUNK_ROWS])
+
+
+def read_table(csv_path, dtypes=None, usecols=None, chunksize=None):
+    """
+    Load a table written by TableWriter: from its Parquet/Feather copy when one is at
+    least as new as the CSV, otherwise from the CSV with explicit dtypes. With
+    chunksize an iterator of DataFrames is returned instead of one DataFrame.
+    """
+    csv_mtime = os.path.getmtime(csv_path) if os.path.exists(csv_path) else None
+    for fmt in ("parquet", "feather"):
+        path = columnar_path(csv_path, fmt)
+        if path.is_file() and (csv_mtime is None or path.stat().st_mtime >= csv_mtime):
+            import_pyarrow()
+            if fmt == "parquet":
+                df = pd.read_parquet(path, columns=usecols)
+            else:
+                df = pd.read_feather(path, columns=usecols)
+            if dtypes:
+                df = df.astype({c: t for c, t in dtypes.items() if c in df.columns})
+            if chunksize is None:
+                return df
+            return (df.iloc[i:i + chunksize] for i in range(0, max(len(df), 1), chunksize))
+    # round_trip: floats come back exactly as written, as from the columnar copy
+    return pd.read_csv(csv_path, dtype=dtypes, usecols=usecols, chunksize=chunksize, float_precision="round_trip")
+
+
+def rusage(children=False):
+    # getrusage of this process (or of its finished children); None where there is none (Windows)
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+
+
+def max_rss_mb(children=False):
+    # peak RSS from getrusage, None if unavailable; ru_maxrss is in KiB on Linux but in bytes on macOS
+    usage = rusage(children)
+    if usage is None:
+        return None
+    return usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def round_or_none(value, digits):
+    return None if value is None else round(value, digits)
+
+
+def format_mb(value):
+    return "n/a" if value is None else f"{value:.0f} MB"
+
+
+def peak_rss_mb():
+    # VmHWM can be reset per stage (see RunMetrics.stage), ru_maxrss is the fallback
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return max_rss_mb()
+
+
+class RunMetrics:
+    """
+    Per-stage wall time, CPU time (this process and finished child processes such as
+    the mining workers and git), peak RSS and throughput counters of a run, saved as
+    JSON. With profile ("cprofile" or "pyinstrument") every stage is also profiled
+    into profile_dir.
+    """
+
+    def __init__(self, path="run_metrics.json", profile=None, profile_dir="profiles"):
+        if profile not in (None, "cprofile", "pyinstrument"):
+            raise ValueError(f"Unknown profiler: {profile}")
+        self.path = path
+        self.profile = profile
+        self.profile_dir = Path(profile_dir)
+        self.started = time.perf_counter()
+        self.run = {"started": datetime.now().isoformat(timespec="seconds"), "argv": sys.argv, "stages": []}
+
+    @contextmanager
+    def stage(self, name):
+        """Measures the with-block; the yielded dict takes counters, e.g. counters["commits"] = n."""
+        counters = {}
+        try:
+            # start this stage's peak RSS from the current RSS (Linux only)
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+        profiler = self._start_profiler()
+        children = rusage(children=True)
+        cpu, wall = time.process_time(), time.perf_counter()
+        status = "failed"
+        try:
+            yield counters
+            status = "ok"
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            children_now = rusage(children=True)
+            entry = {
+                "stage": name,
+                "status": status,
+                "wall_s": round(wall, 4),
+                "cpu_s": round(cpu, 4),
+                "children_cpu_s": None if children is None else
+                round(children_now.ru_utime + children_now.ru_stime - children.ru_utime - children.ru_stime, 4),
+                "peak_rss_mb": round_or_none(peak_rss_mb(), 1),
+                "children_peak_rss_mb": round_or_none(max_rss_mb(children=True), 1),
+                "counters": counters,
+                "rates": {f"{key}_per_sec": round(value / wall, 2) for key, value in counters.items() if wall > 0},
+            }
+            if profiler is not None:
+                entry["profile"] = self._stop_profiler(profiler, name)
+            self.run["stages"].append(entry)
+            print(f"[{name}] {status} in {wall:.2f}s (cpu {cpu:.2f}s, peak RSS {format_mb(entry['peak_rss_mb'])})")
+            self.save()
+
+    def _start_profiler(self):
+        if self.profile == "cprofile":
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif self.profile == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+            except ImportError as e:
+                raise ImportError("--profile pyinstrument needs pyinstrument (pip install pyinstrument)") from e
+            profiler = Profiler()
+            profiler.start()
+        else:
+            profiler = None
+        return profiler
+
+    def _stop_profiler(self, profiler, name):
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        if self.profile == "cprofile":
+            profiler.disable()
+            out_path = self.profile_dir / f"{name}.prof"
+            profiler.dump_stats(out_path)
+        else:
+            profiler.stop()
+            out_path = self.profile_dir / f"{name}.html"
+            out_path.write_text(profiler.output_html(), encoding="utf-8")
+        return str(out_path)
+
+    def save(self):
+        if self.path is None:
+            return
+        self.run["total_wall_s"] = round(time.perf_counter() - self.started, 4)
+        self.run["peak_rss_mb"] = round_or_none(max_rss_mb(), 1)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.run, f, indent=2)
+
+
+def task1(defects=None):
+    if defects is None:
+        defects, = mine_history([DefectConsumer()])
+    defects_per_month, defective_commits = defects.defects_per_month, defects.defective_commits
     occurences_of_files = occ_of_files(defective_commits)
-    with open("defects_per_file.csv", "w", newline="") as f:
-        w = csv.writer(f)
-        w.writerow(["file", "defects"])
-        for key, value in occurences_of_files.items():
-            w.writerow([key, value])
+    # csv.writer line endings, as this file always had
+    with TableWriter("defects_per_file.csv", ["file", "defects"], DEFECT_DTYPES, lineterminator="\r\n") as writer:
+        writer.write(occurences_of_files.items())
     two_most_occuring_files = create_two_most_occuring(occurences_of_files)
     defect_per_month_of_two_most = defect_per_month_of_two_most_occ(defective_commits, two_most_occuring_files)
-    plot_task_1(defects_per_month=defects_per_month, defects_per_month_two_most_occuring=defect_per_month_of_two_most)
-
-def defects_month_commits():
-    # search commits for regex pattern
-    defects_per_month = defaultdict(int)
-    defective_commits = list()
-    for commit in pyd.Repository('./transformers', since=datetime(2023, 1, 1)).traverse_commits():
-        if pattern.search(commit.msg):
-            defective_commits.append(commit) 
-            year_month = commit.committer_date.strftime("%Y-%m")
-            defects_per_month[year_month] += 1
-    return defects_per_month, defective_commits
+    # the render stage draws Task1Plot.png from this table
+    months = sorted(defects_per_month)
+    write_table(pd.DataFrame({"month": months, "defects": [defects_per_month[m] for m in months],
+                              "defects_two_most": [defect_per_month_of_two_most.get(m, 0) for m in months]}),
+                "task1_defects_per_month.csv")
+
+def defects_month_commits(repo_path=REPO_PATH, since=SINCE_DATE, cache_path=CACHE_PATH, backend=HISTORY_BACKEND):
+    defects, = mine_history([DefectConsumer()], repo_path, since, cache_path, backend)
+    return defects.defects_per_month, defects.defective_commits
 
 # count occurences of paths (vs files see below why)
 def occ_of_files(defective_commits):
     occurences_of_files = defaultdict(int)
     for commit in defective_commits:
-        for file in commit.modified_files:
-            # we use path vs filename otherwise in dict we would count same filename but different path as same
-            path = file.new_path or file.old_path
-            if path.endswith(".py"):
-                occurences_of_files[path] += 1 
+        for path in commit.paths:
+            occurences_of_files[path] += commit.is_defect
     return occurences_of_files
 
 def create_two_most_occuring(occ_files):
@@ -69,14 +1069,18 @@ def create_two_most_occuring(occ_files):
 def defect_per_month_of_two_most_occ(defective_commits, top_files):
     defects_per_month_two_most_occuring = defaultdict(int)
     for commit in defective_commits:
-        for file in commit.modified_files:
-            path = file.new_path or file.old_path
+        for path in commit.paths:
             if path in top_files:
                 year_month = commit.committer_date.strftime("%Y-%m")
-                defects_per_month_two_most_occuring[year_month] += 1 
+                defects_per_month_two_most_occuring[year_month] += commit.is_defect
     return defects_per_month_two_most_occuring
 
-def plot_task_1(defects_per_month, defects_per_month_two_most_occuring):
+def plot_task_1(table_path="task1_defects_per_month.csv", out_path="Task1Plot.png"):
+    per_month = read_table(table_path, {"month": str})
+    defects_per_month = dict(zip(per_month["month"], per_month["defects"]))
+    two_most = per_month[per_month["defects_two_most"] > 0]
+    defects_per_month_two_most_occuring = dict(zip(two_most["month"], two_most["defects_two_most"]))
+
     fig, axes = plt.subplots(1, 2, figsize=(20, 8))
 
     # defects per month
@@ -97,45 +1101,145 @@ def plot_task_1(defects_per_month, defects_per_month_two_most_occuring):
     axes[1].set_xticklabels(sorted_month_two_most_occuring, rotation=90)
     axes[1].set_title("Defects per Month of 2 most occuring files")
 
-    plt.tight_layout()
-    plt.savefig("Task1Plot.png", dpi=300)
-
-def run_cloc(repo_root="transformers", out_file="cloc_output.csv"):
-    repo_root = Path(repo_root).resolve()
+    fig.tight_layout()
+    fig.savefig(out_path, dpi=300)
+    plt.close(fig)
 
-    cmd = [
-        "cloc",
-        str(repo_root),
-        "--unix",
-        "--by-file",
-        "--csv",
-        "--quiet",
-        f"--report-file={out_file}",
-    ]
+def write_churn_tables(churn, series_path="churn_per_file_month.csv", summary_path="churn_per_file.csv"):
+    # the monthly series and the per-file summary, which merge_defects joins into task2_loc_cc_defects.csv
+    series = churn.table()
+    summary = churn.summary()
+    write_table(series, series_path)
+    write_table(summary, summary_path, CHURN_DTYPES)
+    print(f"Churn and ownership of {len(summary)} files ({len(series)} file-months) saved to {series_path}, {summary_path}")
+    return series, summary
 
-    subprocess.run(cmd, check=True)
 
 def load_cloc_results(csv_path="cloc_output.csv", repo_root="transformers"):
     repo_root = Path(repo_root).resolve()
     files_data = []
 
-    with open(csv_path, "r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row["language"] != "Python":
-                continue
+    # cloc's CSV ends with a SUM row, hence strings for the counts and the Python filter first
+    chunks = pd.read_csv(csv_path, usecols=["language", "filename", "blank", "comment", "code"],
+                         dtype=str, chunksize=TABLE_CHUNK_ROWS)
+    for chunk in chunks:
+        chunk = chunk[chunk["language"] == "Python"]
+        files_data.append(pd.DataFrame({
+            "file": [str(Path(name).relative_to(repo_root)) if Path(name).is_absolute() else name
+                     for name in chunk["filename"]],
+            "loc": chunk["code"].astype("int64").to_numpy(),
+            "blank": chunk["blank"].astype("int64").to_numpy(),
+            "comment": chunk["comment"].astype("int64").to_numpy(),
+        }))
+
+    return pd.concat(files_data, ignore_index=True) if files_data else pd.DataFrame(columns=["file", "loc", "blank", "comment"])
+
+# cloc's rules for Python, applied in cloc's order; cloc_corpus/ holds the expected counts. One deliberate
+# difference: cloc 2.06 lets a triple quote inside a full-line # comment open a docstring, here it does not
+CLOC_TRIPLE_QUOTE_OPEN = re.compile(r"""[uU]?(\"\"\"|''')""")
+CLOC_TRIPLE_QUOTE = re.compile(r"""(\"\"\"|''')""")
+CLOC_C_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+CLOC_FULL_LINE_COMMENT = re.compile(r"^\s*#")
+CLOC_INLINE_COMMENT = re.compile(r"#.*$")
+
+
+def count_loc(code):
+    """
+    Count code, blank and comment lines of Python source like cloc does.
+    As in cloc, triple quoted strings count as comments and a shebang line as code.
+    """
+    lines = code.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    total = len(lines)
+    blank = sum(1 for line in lines if not line.strip())
+    shebang = bool(lines) and lines[0].startswith("#!")
+
+    # cloc drops lines with C comment markers and full-line # comments (a shebang stays code) first,
+    # then rewrites docstrings to C comments, so a triple quote inside a # comment opens no docstring
+    code_lines = int(shebang)
+    lines = [line for line in lines[int(shebang):]
+             if "/*" not in line and "*/" not in line and not CLOC_FULL_LINE_COMMENT.match(line)]
+
+    in_docstring = False
+    for i, line in enumerate(lines):
+        while CLOC_TRIPLE_QUOTE.search(line):
+            if not in_docstring:
+                line = CLOC_TRIPLE_QUOTE_OPEN.sub("/*", line, count=1)
+            else:
+                line = CLOC_TRIPLE_QUOTE.sub("*/", line, count=1)
+            in_docstring = not in_docstring
+        lines[i] = line
+
+    lines = CLOC_C_COMMENT.sub("", "\n".join(lines)).split("\n")
+
+    for line in lines:
+        if CLOC_INLINE_COMMENT.sub("", line).strip():
+            code_lines += 1
 
-            abs_path = Path(row["filename"])
-            rel_path = abs_path.relative_to(repo_root)
+    return code_lines, blank, total - blank - code_lines
 
-            files_data.append({
-                "file": str(rel_path),
-                "loc": int(row["code"]),
-                "blank": int(row["blank"]),
-                "comment": int(row["comment"]),
-            })
 
-    return pd.DataFrame(files_data)
+def write_cloc_csv(metrics, repo_root="transformers", out_file="cloc_output.csv"):
+    # same layout as "cloc --by-file --csv" (Python rows only)
+    repo_root = Path(repo_root).resolve()
+    with open(out_file, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["language", "filename", "blank", "comment", "code"])
+        for row in metrics.itertuples(index=False):
+            w.writerow(["Python", str(repo_root / row.file), row.blank, row.comment, row.loc])
+        w.writerow(["SUM", "", metrics["blank"].sum(), metrics["comment"].sum(), metrics["loc"].sum()])
+
+
+def compare_loc_with_cloc(metrics, csv_path="cloc_output.csv", repo_root="transformers"):
+    """Regression check of the built-in counter against a cloc report of the same checkout."""
+    cloc_results = load_cloc_results(csv_path, repo_root)
+    merged = metrics.merge(cloc_results, on="file", how="inner", suffixes=("", "_cloc"))
+    same = (
+        (merged["loc"] == merged["loc_cloc"])
+        & (merged["blank"] == merged["blank_cloc"])
+        & (merged["comment"] == merged["comment_cloc"])
+    )
+    print(f"LoC counts identical to cloc for {same.sum()} of {len(merged)} files")
+    return merged[~same]
+
+
+def check_loc_corpus(corpus_dir="cloc_corpus"):
+    """Regression check of the LoC counter against the expected counts of the files in corpus_dir."""
+    corpus_dir = Path(corpus_dir)
+    metrics = pd.DataFrame([(path.name, *count_loc(decode_source(path.read_bytes())[0]))
+                            for path in sorted(corpus_dir.glob("*.py"))],
+                           columns=["file", "loc", "blank", "comment"])
+    mismatches = compare_loc_with_cloc(metrics, corpus_dir / "expected_cloc.csv", corpus_dir)
+    for row in mismatches.itertuples(index=False):
+        print(f"  {row.file}: code/blank/comment {row.loc}/{row.blank}/{row.comment}, "
+              f"expected {row.loc_cloc}/{row.blank_cloc}/{row.comment_cloc}")
+    return mismatches
+
+
+EMPTY_BLOB_SHA = "e69de29bb2d1d6434b8b29ae775ad8c2e48c5391"
+
+
+def compute_cc_blocks(code, file_path):
+    """
+    Total CC of a file (as before, the sum over radon's blocks) and its functions and
+    methods as [qualname, first line, last line, cc], from a single radon run.
+    (None, None) if radon fails.
+    """
+    try:
+        blocks = radon_complexity.cc_visit(code)
+    except Exception as e:
+        print(f"Radon failed on {file_path}: {e}")
+        return None, None
+    total_cc = sum(b.complexity for b in blocks)
+    functions = [[f"{b.classname}.{b.name}" if b.classname else b.name, b.lineno, b.endline, b.complexity]
+                 for b in blocks if not hasattr(b, "methods")]  # classes only repeat their methods
+    return total_cc, functions
+
+
+def compute_cc_from_source(code, file_path):
+    return compute_cc_blocks(code, file_path)[0]
+
 
 def compute_cc_per_file(file_path, repo_root="transformers"):
     full_path = Path(repo_root) / file_path
@@ -147,74 +1251,746 @@ def compute_cc_per_file(file_path, repo_root="transformers"):
         print(f"Error reading {file_path}: {e}")
         return None
 
-    try:
-        blocks = cc_visit(code)
-        total_cc = sum(b.complexity for b in blocks)
-        return total_cc
-    except Exception as e:
-        print(f"Radon failed on {file_path}: {e}")
-        return None
+    return compute_cc_from_source(code, file_path)
+
 
+def measure_job(item):
+    # runs in a worker process: LoC and CC from the same source text
+    blob, file_path, code, parse_cc = item
+    loc, blank, comment = count_loc(code)
+    cc, functions = compute_cc_blocks(code, file_path) if parse_cc else (None, None)
+    return blob, loc, blank, comment, cc, functions
 
-def compute_cc_for_all_files(repo_root="transformers"):
+
+def decode_source(data):
+    # the text reading the file in text mode gives, and the decoding error (radon then gets nothing, as before)
+    try:
+        code, error = data.decode("utf-8"), None
+    except UnicodeDecodeError as e:
+        code, error = data.decode("utf-8", errors="replace"), e
+    return code.replace("\r\n", "\n").replace("\r", "\n"), error
+
+
+# version of the per-blob results (count_loc, radon CC and functions): bump it when their computation changes
+METRICS_VERSION = "2"
+
+
+def open_metrics_cache(cache_path=CACHE_PATH):
+    conn = sqlite3.connect(cache_path, timeout=60)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS blob_metrics (
+            blob TEXT PRIMARY KEY, loc INTEGER, blank INTEGER, comment INTEGER, cc INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS function_metrics (blob TEXT PRIMARY KEY, functions TEXT);
+    """)
+
+    # results of another version are dropped, and the metrics index is rebuilt from the new ones
+    row = conn.execute("SELECT value FROM meta WHERE key = 'metrics_version'").fetchone()
+    if row is None or row[0] != METRICS_VERSION:
+        conn.executescript("DELETE FROM blob_metrics; DELETE FROM function_metrics; "
+                           "DELETE FROM meta WHERE key = 'metrics_commit';")
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('metrics_version', ?)", (METRICS_VERSION,))
+        conn.commit()
+    return conn
+
+
+def store_blob_metrics(conn, results):
+    conn.executemany("INSERT OR REPLACE INTO blob_metrics VALUES (?, ?, ?, ?, ?)", (row[:5] for row in results))
+    # the per-function results of the same parse, for the function-level tables
+    conn.executemany("INSERT OR REPLACE INTO function_metrics VALUES (?, ?)",
+                     ((row[0], json.dumps(row[5])) for row in results))
+    conn.commit()
+
+
+def lookup_blob_metrics(conn, blobs):
+    found = {}
+    blobs = list(blobs)
+    # stay below sqlite's limit of host parameters per statement
+    for i in range(0, len(blobs), 500):
+        chunk = blobs[i:i + 500]
+        query = f"SELECT * FROM blob_metrics WHERE blob IN ({','.join('?' * len(chunk))})"
+        found.update((row[0], row) for row in conn.execute(query, chunk))
+    return found
+
+
+def measure_files(repo_root, py_files, workers=None, chunksize=32, cache_path=CACHE_PATH):
+    """
+    LoC/blank/comment and CC of the given .py files, each file is read once for both
+    metrics. Files are measured in a process pool, in batches so only a bounded number
+    of sources is in flight, and results are cached by git blob SHA so unchanged
+    files are not measured again on later runs.
+    """
     repo_root = Path(repo_root).resolve()
-    py_files = list(repo_root.rglob("*.py"))
+    workers = workers or os.cpu_count() or 1
+    batch_size = workers * chunksize * 4
 
+    conn = open_metrics_cache(cache_path) if cache_path is not None else None
+    pool = None
+    metrics_by_blob = {}
     files_data = []
-    for abs_path in py_files:
-        if "templates" in abs_path.parts:
-            continue
+    n_measured = 0
+    try:
+        for start in range(0, len(py_files), batch_size):
+            batch = []
+            for abs_path in py_files[start:start + batch_size]:
+                rel_path = abs_path.relative_to(repo_root)
+                try:
+                    with open(abs_path, "rb") as f:
+                        data = f.read()
+                except OSError as e:
+                    print(f"Error reading {rel_path}: {e}")
+                    batch.append((rel_path, None, None, False))
+                    continue
+
+                code, error = decode_source(data)
+                if error is not None:
+                    # cloc still counts the lines, radon gets nothing (as before)
+                    print(f"Error reading {rel_path}: {error}")
+                batch.append((rel_path, git_blob_sha(data), code, error is None))
+
+            blobs = {blob for _, blob, _, _ in batch if blob is not None and blob not in metrics_by_blob}
+            if conn is not None:
+                metrics_by_blob.update(lookup_blob_metrics(conn, blobs))
+
+            todo = {}
+            for rel_path, blob, code, parse_cc in batch:
+                if blob is not None and blob not in metrics_by_blob and blob not in todo:
+                    todo[blob] = (blob, str(rel_path), code, parse_cc)
+
+            if todo:
+                if workers > 1 and pool is None:
+                    pool = futures.ProcessPoolExecutor(max_workers=workers)
+                if pool is not None:
+                    results = list(pool.map(measure_job, todo.values(), chunksize=chunksize))
+                else:
+                    results = [measure_job(item) for item in todo.values()]
+                metrics_by_blob.update((row[0], row[:5]) for row in results)
+                n_measured += len(results)
+                if conn is not None:
+                    store_blob_metrics(conn, results)
+
+            for rel_path, blob, _, _ in batch:
+                _, loc, blank, comment, cc = metrics_by_blob.get(blob, (None,) * 5)
+                files_data.append({"file": str(rel_path), "blob": blob, "loc": loc, "blank": blank,
+                                   "comment": comment, "cc": cc})
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if conn is not None:
+            conn.close()
+
+    print(f"Measured {len(files_data)} files ({n_measured} parsed, {len(files_data) - n_measured} reused from the cache or identical files)")
+    return pd.DataFrame(files_data, columns=["file", "blob", "loc", "blank", "comment", "cc"])
+
+
+def measure_all_files(repo_root="transformers", workers=None, chunksize=32, cache_path=CACHE_PATH):
+    # every .py file of the checkout, templates excluded (they contain invalid Python placeholders)
+    repo_root = Path(repo_root).resolve()
+    py_files = [p for p in repo_root.rglob("*.py") if "templates" not in p.parts]
+    return measure_files(repo_root, py_files, workers, chunksize, cache_path)
+
+
+def compute_cc_for_all_files(repo_root="transformers", workers=None, chunksize=32, cache_path=CACHE_PATH):
+    metrics = measure_all_files(repo_root, workers, chunksize, cache_path)
+    return pd.DataFrame({"file": metrics["file"], "cc": metrics["cc"].tolist()})
+
+
+def open_metrics_index(cache_path=CACHE_PATH):
+    conn = open_metrics_cache(cache_path)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS metrics_index (
+            path TEXT PRIMARY KEY, blob TEXT, loc INTEGER, blank INTEGER, comment INTEGER, cc INTEGER
+        );
+    """)
+    return conn
+
 
-        rel_path = abs_path.relative_to(repo_root)
-        cc = compute_cc_per_file(rel_path, repo_root)
-        files_data.append({"file": str(rel_path), "cc": cc})
+def git_paths(repo_root, *args):
+    # NUL separated path list of a git command, relative to repo_root
+    return {p for p in git_output(repo_root, *args).split("\0") if p}
+
+
+def uncommitted_paths(repo_root):
+    return git_paths(repo_root, "diff", "--name-only", "-z", "--no-renames", "--relative", "HEAD") | \
+        git_paths(repo_root, "ls-files", "--others", "--exclude-standard", "-z")
+
+
+def update_metrics_index(repo_root="transformers", workers=None, cache_path=CACHE_PATH):
+    """
+    Per-path index of LoC/CC. The first run measures the whole checkout, later runs only
+    re-measure files that differ from the last indexed commit (committed or not), new
+    untracked files and files that were uncommitted at the last update; deleted files
+    are dropped. Files ignored by git are only picked up by a full rebuild.
+    Returns the same table as measure_all_files.
+    """
+    repo_root = Path(repo_root).resolve()
+    with closing(open_metrics_index(cache_path)) as conn:
+        meta = dict(conn.execute("SELECT key, value FROM meta WHERE key LIKE 'metrics_%'"))
+        head = git_output(repo_root, "rev-parse", "HEAD").strip()
+
+        changed = None
+        if meta.get("metrics_root") == str(repo_root) and "metrics_commit" in meta:
+            try:
+                changed = git_paths(repo_root, "diff", "--name-only", "-z", "--no-renames", "--relative",
+                                    meta["metrics_commit"])
+            except subprocess.CalledProcessError:
+                print("Last indexed commit is gone, rebuilding the metrics index")
+        if changed is not None:
+            changed |= git_paths(repo_root, "ls-files", "--others", "--exclude-standard", "-z")
+            changed |= set(json.loads(meta["metrics_dirty"]))
+            changed = {p for p in changed if p.endswith(".py") and "templates" not in (repo_root / p).parts}
+            present = [repo_root / p for p in sorted(changed) if (repo_root / p).is_file()]
+            print(f"Metrics index: {len(changed)} changed files since {meta['metrics_commit'][:10]}")
+            measured = measure_files(repo_root, present, workers, cache_path=cache_path)
+        else:
+            measured = measure_all_files(repo_root, workers, cache_path=cache_path)
+
+        # the measuring above uses its own connection, only write once it is done
+        if changed is None:
+            conn.execute("DELETE FROM metrics_index")
+        else:
+            conn.executemany("DELETE FROM metrics_index WHERE path = ?", ((p,) for p in changed))
+        rows = measured[["file", "blob", "loc", "blank", "comment", "cc"]].astype(object)
+        conn.executemany("INSERT OR REPLACE INTO metrics_index VALUES (?, ?, ?, ?, ?, ?)",
+                         rows.where(rows.notna(), None).itertuples(index=False, name=None))
+
+        dirty = [p for p in uncommitted_paths(repo_root) if p.endswith(".py")]
+        conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [
+            ("metrics_root", str(repo_root)),
+            ("metrics_commit", head),
+            ("metrics_dirty", json.dumps(sorted(dirty))),
+        ])
+        conn.commit()
+
+        index = pd.read_sql_query("SELECT path AS file, blob, loc, blank, comment, cc FROM metrics_index ORDER BY path", conn)
+    return index
+
+
+def loc_cc_table(metrics):
+    """
+    The task2_loc_cc.csv table as cloc + radon produced it: sorted like cloc's
+    by-file report (code lines descending, then path) and, like cloc, without
+    empty files and with only one file of every set of identical files (the first path).
+    """
+    measured = metrics.dropna(subset=["loc"])
+    measured = measured[measured["blob"] != EMPTY_BLOB_SHA]
+    unique = measured.sort_values("file").drop_duplicates("blob")
+    table = unique.sort_values(["loc", "file"], ascending=[False, True])[["file", "loc", "blank", "comment", "cc"]]
+    table = table.astype({"loc": int, "blank": int, "comment": int})
+    return table.reset_index(drop=True)
+
+
+def function_job(item):
+    # runs in a worker process: the functions of one source
+    blob, file_path, code = item
+    return blob, compute_cc_blocks(code, file_path)[1]
+
+
+def blob_functions(blobs, read_sources, workers=None, cache_path=CACHE_PATH, batch_size=512):
+    """
+    {blob: [[qualname, first line, last line, cc], ...] or None} for the given blobs.
+    Blobs measured before (by measure_files or an earlier call) come from the cache,
+    read_sources(missing) returns {blob: (label, source)} for the others, which are
+    parsed in a process pool and cached.
+    """
+    blobs = set(blobs)
+    found = {}
+    conn = open_metrics_cache(cache_path) if cache_path is not None else None
+    pool = None
+    try:
+        if conn is not None:
+            blob_list = list(blobs)
+            for i in range(0, len(blob_list), 500):
+                chunk = blob_list[i:i + 500]
+                query = f"SELECT blob, functions FROM function_metrics WHERE blob IN ({','.join('?' * len(chunk))})"
+                found.update((blob, json.loads(functions)) for blob, functions in conn.execute(query, chunk))
+
+        missing = sorted(blobs - set(found))
+        workers = workers or os.cpu_count() or 1
+        if workers > 1 and len(missing) > 1:
+            pool = futures.ProcessPoolExecutor(max_workers=workers)
+        # in batches, so only a bounded number of sources is in memory
+        for start in range(0, len(missing), batch_size):
+            items = [(blob, label, code) for blob, (label, code) in
+                     read_sources(missing[start:start + batch_size]).items()]
+            if pool is not None:
+                results = list(pool.map(function_job, items, chunksize=8))
+            else:
+                results = [function_job(item) for item in items]
+            found.update(results)
+            if conn is not None:
+                conn.executemany("INSERT OR REPLACE INTO function_metrics VALUES (?, ?)",
+                                 ((blob, json.dumps(functions)) for blob, functions in results))
+                conn.commit()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if conn is not None:
+            conn.close()
+    return found
+
+
+def read_git_blobs(repo_path, shas, batch_size=2000, raw=False):
+    # {sha: source} of the blobs (bytes with raw), through git cat-file --batch runs of batch_size blobs
+    shas = list(shas)
+    sources = {}
+    for start in range(0, len(shas), batch_size):
+        batch = shas[start:start + batch_size]
+        out = subprocess.run(["git", "-C", str(repo_path), "cat-file", "--batch"],
+                             input="".join(f"{sha}\n" for sha in batch).encode(), capture_output=True,
+                             check=True).stdout
+        pos = 0
+        for sha in batch:
+            end = out.index(b"\n", pos)
+            header = out[pos:end].split()
+            pos = end + 1
+            if len(header) < 3 or header[1] != b"blob":
+                continue  # missing
+            size = int(header[2])
+            data = out[pos:pos + size]
+            sources[sha] = data if raw else data.decode("utf-8", errors="replace") \
+                .replace("\r\n", "\n").replace("\r", "\n")
+            pos += size + 1
+    return sources
+
+
+def monthly_snapshots(repo_path=REPO_PATH, since=SINCE_DATE):
+    # (month, commit) of the last first-parent commit of every month since `since`, oldest month first
+    out = git_output(repo_path, "log", "--first-parent", f"--since={since}", "--format=%H %cI", "HEAD")
+    snapshots = {}
+    for line in out.splitlines():
+        sha, committer_date = line.split()
+        # newest commits come first; months as in defects_month_commits (committer date)
+        snapshots.setdefault(committer_date[:7], sha)
+    return sorted(snapshots.items())
+
+
+def snapshot_files(repo_path, commit):
+    # (path, blob) of the .py files in the commit's tree, templates excluded like in measure_all_files
+    out = subprocess.run(["git", "-C", str(repo_path), "ls-tree", "-r", "-z", "--full-tree", commit],
+                         capture_output=True, check=True).stdout
+    files = []
+    for entry in out.split(b"\0"):
+        if not entry:
+            continue
+        info, path = entry.split(b"\t", 1)
+        mode, kind, blob = info.decode().split()
+        path = path.decode("utf-8", errors="replace")
+        if kind == "blob" and mode != "120000" and path.endswith(".py") and "templates" not in Path(path).parts:
+            files.append((path, blob))
+    return files
+
+
+def measure_blobs(repo_path, labels, workers=None, chunksize=32, cache_path=CACHE_PATH):
+    """
+    {blob: (blob, loc, blank, comment, cc)} of the blobs in labels ({blob: path}).
+    Blobs measured before, in any checkout or snapshot, come from the cache; the
+    others are read with git cat-file (no checkout) and measured in a process pool.
+    """
+    workers = workers or os.cpu_count() or 1
+    batch_size = workers * chunksize * 4
+    conn = open_metrics_cache(cache_path) if cache_path is not None else None
+    pool = None
+    found = {}
+    try:
+        if conn is not None:
+            found.update(lookup_blob_metrics(conn, labels))
+        missing = [blob for blob in labels if blob not in found]
+        if workers > 1 and len(missing) > 1:
+            pool = futures.ProcessPoolExecutor(max_workers=workers)
+        for start in range(0, len(missing), batch_size):
+            items = []
+            for blob, data in read_git_blobs(repo_path, missing[start:start + batch_size], raw=True).items():
+                code, error = decode_source(data)
+                if error is not None:
+                    print(f"Error reading {labels[blob]} ({blob}): {error}")
+                items.append((blob, labels[blob], code, error is None))
+            if pool is not None:
+                results = list(pool.map(measure_job, items, chunksize=chunksize))
+            else:
+                results = [measure_job(item) for item in items]
+            found.update((row[0], row[:5]) for row in results)
+            if conn is not None:
+                store_blob_metrics(conn, results)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if conn is not None:
+            conn.close()
+    print(f"Measured {len(labels)} distinct blobs ({len(missing)} parsed, the others from the cache)")
+    return found
+
+
+def snapshot_metrics(repo_path=REPO_PATH, since=SINCE_DATE, workers=None, cache_path=CACHE_PATH,
+                     out_path="task2_loc_cc_monthly.csv", summary_path="task2_hotspots_monthly.csv"):
+    """
+    LoC/CC of every .py file at the last commit of each month, read from git objects
+    without touching the worktree. Every distinct blob is measured once over all
+    snapshots (and across runs through the blob cache), so many snapshots cost little
+    more than one full scan. Writes the per-file table of every month and a per-month
+    summary with the hotspot count (cc or loc in the month's top 10%) and the top CC file.
+    """
+    snapshots = monthly_snapshots(repo_path, since)
+    trees = [(month, commit, snapshot_files(repo_path, commit)) for month, commit in snapshots]
+    labels = {}
+    for _, _, files in trees:
+        for path, blob in files:
+            labels.setdefault(blob, path)
+    metrics_by_blob = measure_blobs(repo_path, labels, workers, cache_path=cache_path)
+
+    columns = ["month", "commit", "file", "loc", "blank", "comment", "cc"]
+    summary = []
+    with TableWriter(out_path, columns) as writer:
+        for month, commit, files in trees:
+            rows = [(path, blob, *metrics_by_blob.get(blob, (None,) * 5)[1:]) for path, blob in files]
+            table = loc_cc_table(pd.DataFrame(rows, columns=["file", "blob", "loc", "blank", "comment", "cc"]))
+            table.insert(0, "commit", commit)
+            table.insert(0, "month", month)
+            writer.write(table)
+
+            hot = (table["cc"] >= table["cc"].quantile(0.90)) | (table["loc"] >= table["loc"].quantile(0.90))
+            top = table.loc[table["cc"].idxmax()] if table["cc"].notna().any() else None
+            summary.append((month, commit, len(table), table["loc"].sum(), table["cc"].sum(), int(hot.sum()),
+                            None if top is None else top["file"], None if top is None else top["cc"]))
+
+    summary = pd.DataFrame(summary, columns=["month", "commit", "files", "loc", "cc", "hotspots", "top_cc_file",
+                                             "top_cc"])
+    write_table(summary, summary_path)
+    print(f"Metrics of {len(snapshots)} monthly snapshots ({len(labels)} distinct blobs) saved to {out_path}, "
+          f"{summary_path}")
+    return summary
+
+
+HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+
+
+def iter_changed_ranges(repo_path, shas):
+    """
+    (commit, path, blob after the commit, [(first, last), ...] changed lines) of every
+    .py file the commits modify, streamed from one git log -p -U0 run. Line ranges are
+    on the new side; a pure deletion counts as the line it happened at.
+    """
+    if not shas:
+        # git log --stdin without revisions falls back to HEAD
+        return
+    proc = subprocess.Popen(
+        ["git", "-C", str(repo_path), "-c", "core.quotePath=false", "log", "--no-walk=unsorted", "--stdin",
+         "-p", "-U0", "--full-index", "-M", "--format=%x1e%H", "--", "*.py"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, encoding="utf-8", errors="replace",
+    )
+    # git reads all revisions before it writes anything
+    proc.stdin.write("".join(f"{sha}\n" for sha in shas))
+    proc.stdin.close()
+
+    sha, path, blob, ranges = None, None, None, []
+    for line in proc.stdout:
+        line = line.rstrip("\n")
+        if line.startswith("\x1e") or line.startswith("diff --git "):
+            if path is not None and ranges:
+                yield sha, path, blob, ranges
+            path, blob, ranges = None, None, []
+            if line.startswith("\x1e"):
+                sha = line[1:]
+        elif line.startswith("index "):
+            blob = line.split()[1].split("..")[1]
+        elif line.startswith("+++ "):
+            target = line[4:].strip('"')
+            path = target[2:] if target.startswith("b/") else None
+        elif line.startswith("@@") and path is not None:
+            match = HUNK_HEADER.match(line)
+            if match:
+                first, count = int(match.group(1)), int(match.group(2) or 1)
+                ranges.append((max(first, 1), max(first + count - 1, first, 1)))
+    if path is not None and ranges:
+        yield sha, path, blob, ranges
+    if proc.wait() != 0:
+        raise subprocess.CalledProcessError(proc.returncode, "git log -p")
+
+
+def function_defects(repo_path, defective_commits, workers=None, cache_path=CACHE_PATH):
+    """
+    Counter of (path, qualname) -> defect commits whose changed lines fall inside the
+    function, using the function boundaries of the file as of that commit.
+    """
+    shas = [commit.hash for commit in defective_commits]
+    if not shas:
+        return Counter()
+    changes = list(iter_changed_ranges(repo_path, shas))
+    functions = blob_functions({blob for _, _, blob, _ in changes if blob},
+                               lambda missing: {blob: (blob, code) for blob, code in
+                                                read_git_blobs(repo_path, missing).items()},
+                               workers, cache_path)
+    defects = Counter()
+    for sha, path, blob, ranges in changes:
+        touched = set()
+        for qualname, first, last, _ in functions.get(blob) or ():
+            if any(start <= last and end >= first for start, end in ranges):
+                touched.add(qualname)
+        for qualname in touched:
+            defects[(path, qualname)] += 1
+    return defects
+
+
+def function_hotspots(repo_root="transformers", defective_commits=(), workers=None, cache_path=CACHE_PATH):
+    """
+    Function-level Task 2: every function and method of the checkout with its CC and
+    the defect commits that changed it, written to task2_functions.csv; the functions
+    in the top 10% by CC or by defects go to task2_function_hotspots.csv (sorted by CC).
+    """
+    repo_root = Path(repo_root).resolve()
+    metrics = update_metrics_index(repo_root, workers, cache_path)
+    paths_by_blob = dict(zip(metrics["blob"], metrics["file"]))
+
+    def read_checkout(missing):
+        sources = {}
+        for blob in missing:
+            with open(repo_root / paths_by_blob[blob], "rb") as f:
+                sources[blob] = (paths_by_blob[blob], f.read().decode("utf-8", errors="replace")
+                                 .replace("\r\n", "\n").replace("\r", "\n"))
+        return sources
+
+    functions = blob_functions(metrics["blob"].dropna(), read_checkout, workers, cache_path)
+    defects = function_defects(repo_root, defective_commits, workers, cache_path)
+
+    rows = []
+    for path, blob in zip(metrics["file"], metrics["blob"]):
+        for qualname, first, last, cc in functions.get(blob) or ():
+            rows.append((path, qualname, first, last, cc, defects.get((path, qualname), 0)))
+    table = pd.DataFrame(rows, columns=["file", "function", "lineno", "endline", "cc", "defects"])
+    table = table.sort_values(["file", "lineno"]).reset_index(drop=True)
+    write_table(table, "task2_functions.csv")
+
+    hot = (table["cc"] >= table["cc"].quantile(0.90)) | \
+          ((table["defects"] > 0) & (table["defects"] >= table["defects"].quantile(0.90)))
+    hotspots = table[hot].sort_values(["cc", "defects"], ascending=False)
+    write_table(hotspots, "task2_function_hotspots.csv")
+    print(f"{len(table)} functions, {int((table['defects'] > 0).sum())} touched by defect commits, "
+          f"{len(hotspots)} hotspots")
+    return table, hotspots
+
+
+# weight of every signal in the hotspot score; "days_since_change" counts as hotter when lower
+HOTSPOT_WEIGHTS = {"cc": 0.25, "loc": 0.1, "defects": 0.2, "commits": 0.1, "churn": 0.15, "coupling_degree": 0.1,
+                   "days_since_change": 0.1}
+HOTSPOT_LOWER_IS_HOTTER = {"days_since_change"}
+
+
+class HotspotEngine:
+    """
+    Scores files over several signals at once. Every signal is a float64 column;
+    its percentile rank (pandas' rank(pct=True), ties averaged) is looked up with
+    searchsorted in a sorted copy of the column, and the score is the weighted mean
+    of the percentile ranks. update() changes a few files' signals by inserting into
+    and deleting from the sorted copies, instead of sorting every column again.
+    """
+
+    def __init__(self, signals, weights=None):
+        self.weights = dict(weights or HOTSPOT_WEIGHTS)
+        self.signals = [name for name in self.weights if name in signals.columns]
+        self.files = signals.index.to_numpy(dtype=object)
+        self.position = {f: i for i, f in enumerate(self.files)}
+        self.values = {name: self._keyed(name, signals[name]) for name in self.signals}
+        self.sorted = {name: np.sort(self.values[name]) for name in self.signals}
+        self.pct = {name: self._percentiles(name) for name in self.signals}
+
+    @staticmethod
+    def _keyed(name, column):
+        values = pd.to_numeric(column, errors="coerce").fillna(0).to_numpy(dtype=np.float64)
+        return -values if name in HOTSPOT_LOWER_IS_HOTTER else values
+
+    def _percentiles(self, name):
+        ordered = self.sorted[name]
+        values = self.values[name]
+        below = np.searchsorted(ordered, values, side="left")
+        upto = np.searchsorted(ordered, values, side="right")
+        return (below + upto + 1) / 2 / len(ordered) if len(ordered) else values
+
+    def update(self, changes):
+        """Replace the signals of the files in changes (a DataFrame indexed by file), adding new files."""
+        changes = changes[[name for name in self.signals if name in changes.columns]]
+        new_files = [f for f in changes.index if f not in self.position]
+        if new_files:
+            for i, f in enumerate(new_files):
+                self.position[f] = len(self.files) + i
+            self.files = np.concatenate([self.files, np.array(new_files, dtype=object)])
+            for name in self.signals:
+                # new files start at 0 until their values are set below
+                self.values[name] = np.concatenate([self.values[name], np.zeros(len(new_files))])
+                self.sorted[name] = np.insert(self.sorted[name], np.searchsorted(self.sorted[name], 0.0),
+                                              np.zeros(len(new_files)))
+
+        rows = np.array([self.position[f] for f in changes.index], dtype=np.int64)
+        for name in self.signals:
+            if name not in changes.columns and not new_files:
+                continue
+            if name in changes.columns:
+                new = np.sort(self._keyed(name, changes[name]))
+                old = np.sort(self.values[name][rows])
+                # equal old values sit next to each other in the sorted copy: step past the ones already taken
+                repeat = np.arange(len(old)) - np.searchsorted(old, old, side="left")
+                ordered = np.delete(self.sorted[name], np.searchsorted(self.sorted[name], old) + repeat)
+                self.sorted[name] = np.insert(ordered, np.searchsorted(ordered, new), new)
+                self.values[name][rows] = self._keyed(name, changes[name])
+            self.pct[name] = self._percentiles(name)
+
+    def scores(self):
+        total = sum(self.weights[name] for name in self.signals) or 1.0
+        return sum(self.weights[name] * self.pct[name] for name in self.signals) / total
+
+    def top(self, k):
+        """Indices of the k best scored files, best first (argpartition, no full sort)."""
+        scores = self.scores()
+        if k < len(scores):
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+    def table(self, top_k=None):
+        """Files with their signals, percentile ranks and score, best score first."""
+        order = self.top(top_k if top_k is not None else len(self.files))
+        scores = self.scores()
+        columns = {"file": self.files[order]}
+        for name in self.signals:
+            values = self.values[name][order]
+            # + 0.0 turns the -0.0 of negated zeros back into 0.0
+            columns[name] = -values + 0.0 if name in HOTSPOT_LOWER_IS_HOTTER else values
+        for name in self.signals:
+            columns[f"pct_{name}"] = self.pct[name][order]
+        columns["score"] = scores[order]
+        columns["rank"] = np.arange(1, len(order) + 1)
+        return pd.DataFrame(columns)
+
+
+def hotspot_signals(all_results, defects=None, activity=None, co_change=None, min_commits_pair=2, churn=None):
+    """
+    The signal table of the hotspot engine, indexed by file: cc and loc of the Task 2
+    table plus, when given, defect commits (defects_per_file), commits and days since
+    the last change (FileActivityConsumer, relative to the newest change seen), coupling
+    degree (number of files co-changed at least min_commits_pair times) and line churn,
+    lines added plus deleted (churn_per_file).
+    """
+    signals = pd.DataFrame({"cc": all_results["cc"].to_numpy(dtype=np.float64),
+                            "loc": all_results["loc"].to_numpy(dtype=np.float64)},
+                           index=pd.Index(all_results["file"], name="file"))
+    if defects is not None:
+        signals["defects"] = signals.index.map(dict(zip(defects["file"], defects["defects"]))).fillna(0)
+    if activity is not None:
+        signals["commits"] = signals.index.map(activity.commits).fillna(0)
+        if activity.last_change:
+            newest = max(activity.last_change.values())
+            days = {path: (newest - when).total_seconds() / 86400 for path, when in activity.last_change.items()}
+            # never changed in the analysed history: as old as the oldest change
+            signals["days_since_change"] = signals.index.map(days).fillna(max(days.values()))
+    if co_change is not None:
+        f1, f2, counts = co_change.pairs()
+        keep = counts >= min_commits_pair
+        degree = np.bincount(np.concatenate([f1[keep], f2[keep]]), minlength=len(co_change.paths))
+        signals["coupling_degree"] = signals.index.map(dict(zip(co_change.paths, degree.tolist()))).fillna(0)
+    if churn is not None:
+        signals["churn"] = signals.index.map(dict(zip(churn["file"], churn["churn"]))).fillna(0)
+    return signals
+
+
+def score_hotspots(signals, weights=None, out_path="task2_hotspot_scores.csv"):
+    engine = HotspotEngine(signals, weights)
+    table = engine.table()
+    write_table(table, out_path)
+    print(f"Scored {len(table)} files on {', '.join(engine.signals)}, saved to {out_path}")
+    return engine, table
+
+
+def refresh_hotspot_scores(all_results, scores_path="task2_hotspot_scores.csv"):
+    """
+    Update mode: the new cc/loc of changed and new files go into the saved scores with
+    HotspotEngine.update(), the history signals (defects, commits, churn, ...) are kept
+    from the last full run, so nothing is mined. New files have no history yet: no
+    defects, commits or churn, and as old as the oldest change (as in hotspot_signals).
+    """
+    table = read_table(scores_path, {"file": str})
+    signals = table.set_index("file")[[name for name in HOTSPOT_WEIGHTS if name in table.columns]]
+    current = all_results.set_index("file")[["cc", "loc"]].apply(pd.to_numeric, errors="coerce").fillna(0)
+    # deleted files leave the ranking, which only a new engine can do
+    engine = HotspotEngine(signals[signals.index.isin(current.index)])
+
+    # new files, and files whose cc or loc differ from the saved ones
+    old = signals[["cc", "loc"]].reindex(current.index)
+    changed = current[old.isna().any(axis=1) | (current != old).any(axis=1)]
+    if "days_since_change" in signals.columns and len(signals):
+        days = signals["days_since_change"]
+        changed = changed.assign(days_since_change=days.reindex(changed.index).fillna(days.max()).to_numpy())
+    engine.update(changed)
+    table = engine.table()
+    write_table(table, scores_path)
+    print(f"Updated the hotspot scores of {len(changed)} files, saved to {scores_path}")
+    return engine, table
+
+
+def add_ranks(all_results):
+    # the rank columns also end up in task2_loc_cc_defects.csv
+    all_results["cc_rank"] = all_results["cc"].rank(ascending=False)
+    all_results["loc_rank"] = all_results["loc"].rank(ascending=False)
 
-    return pd.DataFrame(files_data)
 
 def identify_hotspots(all_results):
     cc_threshold = all_results["cc"].quantile(0.90)
     loc_threshold = all_results["loc"].quantile(0.90)
 
-    all_results["cc_rank"] = all_results["cc"].rank(ascending=False)
-    all_results["loc_rank"] = all_results["loc"].rank(ascending=False)
+    add_ranks(all_results)
 
     hotspots = all_results[(all_results["cc"] >= cc_threshold) | (all_results["loc"] >= loc_threshold)]
     hotspots_sorted = hotspots.sort_values(by="cc", ascending=False)
 
-    hotspots_sorted.to_csv("task2_hotspots.csv", index=False)
+    write_table(hotspots_sorted, "task2_hotspots.csv")
 
     return hotspots_sorted
 
-def plot_hotspots(all_results, hotspots):
-    plot.figure(figsize=(14, 9))
+def plot_hotspots(loc_cc_path="task2_loc_cc.csv", hotspots_path="task2_hotspots.csv",
+                  out_path="complexity_hotspots.png"):
+    all_results = read_table(loc_cc_path, {"file": str})
+    hotspots = read_table(hotspots_path, {"file": str})
+    fig, ax = plt.subplots(figsize=(14, 9))
 
-    plot.scatter(all_results["loc"], all_results["cc"], alpha=0.3, label="All files")
-    plot.scatter(hotspots["loc"], hotspots["cc"], alpha=0.9, color="red", label="Hotspots")
+    ax.scatter(all_results["loc"], all_results["cc"], alpha=0.3, label="All files")
+    ax.scatter(hotspots["loc"], hotspots["cc"], alpha=0.9, color="red", label="Hotspots")
 
     top5 = all_results.nlargest(5, "cc")
-    for _, row in top5.iterrows():
-        plot.text(row["loc"], row["cc"], row["file"], fontsize=7)
+    for loc, cc, file in zip(top5["loc"], top5["cc"], top5["file"]):
+        ax.text(loc, cc, file, fontsize=7)
 
-    plot.xlabel("Lines of Code (LoC)")
-    plot.ylabel("Cyclomatic Complexity (CC)")
-    plot.title("Complexity Hotspots in the Transformers Repository")
-    plot.legend()
-    plot.grid(True)
+    ax.set_xlabel("Lines of Code (LoC)")
+    ax.set_ylabel("Cyclomatic Complexity (CC)")
+    ax.set_title("Complexity Hotspots in the Transformers Repository")
+    ax.legend()
+    ax.grid(True)
 
-    plot.savefig("complexity_hotspots.png", dpi=300)
+    fig.savefig(out_path, dpi=300)
+    plt.close(fig)
 
 def compute_correlation(all_results):
     corr = all_results["loc"].corr(all_results["cc"])
-    pd.DataFrame({"correlation_loc_cc": [corr]}).to_csv("task2_correlation.csv", index=False)
+    write_table(pd.DataFrame({"correlation_loc_cc": [corr]}), "task2_correlation.csv")
     return corr
 
-def analyse_defects(all_results, defects_path="defects_per_file.csv"):
-    defects = pd.read_csv(defects_path)
+def merge_defects(all_results, defects_path="defects_per_file.csv", churn_path=None):
+    defects = read_table(defects_path, DEFECT_DTYPES)
 
     all_results_merged = all_results.merge(defects, on="file", how="left")
     all_results_merged["defects"] = all_results_merged["defects"].fillna(0)
 
-    all_results_merged.to_csv("task2_loc_cc_defects.csv", index=False)
+    if churn_path is not None:
+        # files without commits in the analysed history have no churn, and no owner
+        all_results_merged = all_results_merged.merge(read_table(churn_path, CHURN_DTYPES), on="file", how="left")
+        counts = ["lines_added", "lines_deleted", "churn", "authors"]
+        all_results_merged[counts] = all_results_merged[counts].fillna(0)
+
+    write_table(all_results_merged, "task2_loc_cc_defects.csv")
+    return all_results_merged
+
+def analyse_defects(all_results, defects_path="defects_per_file.csv", churn_path=None):
+    all_results_merged = merge_defects(all_results, defects_path, churn_path)
 
     corr_cc_defects = all_results_merged["cc"].corr(all_results_merged["defects"])
     corr_loc_defects = all_results_merged["loc"].corr(all_results_merged["defects"])
@@ -231,23 +2007,6 @@ def analyse_defects(all_results, defects_path="defects_per_file.csv"):
     print(f"Avg defects (high CC files): {avg_defects_high}")
     print(f"Avg defects (low CC files):  {avg_defects_low}")
 
-    plot.figure(figsize=(12, 8))
-    plot.scatter(all_results_merged["cc"], all_results_merged["defects"], alpha=0.5)
-    plot.xlabel("Cyclomatic Complexity (CC)")
-    plot.ylabel("# Defect-related commits")
-    plot.title("Defects vs Cyclomatic Complexity")
-    plot.grid(True)
-    plot.savefig("defects_vs_cc.png", dpi=300)
-
-    plot.figure(figsize=(10, 6))
-    plot.boxplot(
-        [all_results_merged[high_cc]["defects"], all_results_merged[~high_cc]["defects"]],
-        labels=["High CC (top 10%)", "Lower 90%"],
-    )
-    plot.ylabel("# Defect-related commits")
-    plot.title("Defect Distribution by CC Group")
-    plot.savefig("defect_boxplot_cc_groups.png", dpi=300)
-
     return {
         "corr_cc_defects": corr_cc_defects,
         "corr_loc_defects": corr_loc_defects,
@@ -256,103 +2015,167 @@ def analyse_defects(all_results, defects_path="defects_per_file.csv"):
         "all_results_merged": all_results_merged,
     }
 
-def task2_2():
-    run_cloc("transformers", "cloc_output.csv")
-    loc_results = load_cloc_results("cloc_output.csv")
-    cc_results = compute_cc_for_all_files("transformers")
 
-    all_results = loc_results.merge(cc_results, on="file", how="inner")
-    all_results.to_csv("task2_loc_cc.csv", index=False)
+def plot_defects_vs_cc(merged_path="task2_loc_cc_defects.csv", out_path="defects_vs_cc.png"):
+    all_results_merged = read_table(merged_path, {"file": str}, usecols=["cc", "defects"])
+    fig, ax = plt.subplots(figsize=(12, 8))
+    ax.scatter(all_results_merged["cc"], all_results_merged["defects"], alpha=0.5)
+    ax.set_xlabel("Cyclomatic Complexity (CC)")
+    ax.set_ylabel("# Defect-related commits")
+    ax.set_title("Defects vs Cyclomatic Complexity")
+    ax.grid(True)
+    fig.savefig(out_path, dpi=300)
+    plt.close(fig)
+
+
+def plot_defect_boxplot(merged_path="task2_loc_cc_defects.csv", out_path="defect_boxplot_cc_groups.png"):
+    all_results_merged = read_table(merged_path, {"file": str}, usecols=["cc", "defects"])
+    # the same groups analyse_defects compares
+    high_cc = all_results_merged["cc"] >= all_results_merged["cc"].quantile(0.90)
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.boxplot(
+        [all_results_merged[high_cc]["defects"], all_results_merged[~high_cc]["defects"]],
+        labels=["High CC (top 10%)", "Lower 90%"],
+    )
+    ax.set_ylabel("# Defect-related commits")
+    ax.set_title("Defect Distribution by CC Group")
+    fig.savefig(out_path, dpi=300)
+    plt.close(fig)
+
+def task2_2(repo_root="transformers", write_cloc_output=False):
+    # LoC and CC from one read per file, no external cloc run needed; only changed files are re-measured
+    metrics = update_metrics_index(repo_root)
+    all_results = loc_cc_table(metrics)
+    if write_cloc_output:
+        write_cloc_csv(all_results, repo_root, "cloc_output.csv")
+
+    write_table(all_results, "task2_loc_cc.csv")
 
     return all_results
 
 
+def refresh_task2_tables(repo_root="transformers"):
+    """
+    Update mode: bring the metrics index up to date and regenerate task2_loc_cc.csv,
+    task2_hotspots.csv and task2_loc_cc_defects.csv from it, without any plotting.
+    task2_hotspot_scores.csv, if there is one, gets the new cc/loc (refresh_hotspot_scores).
+    """
+    start = time.perf_counter()
+    all_results = task2_2(repo_root)
+    identify_hotspots(all_results)
+    if os.path.exists("defects_per_file.csv"):
+        merge_defects(all_results, churn_path="churn_per_file.csv" if os.path.exists("churn_per_file.csv") else None)
+    if os.path.exists("task2_hotspot_scores.csv"):
+        refresh_hotspot_scores(all_results)
+    print(f"Refreshed Task 2 tables in {time.perf_counter() - start:.2f}s")
+    return all_results
+
+
 def task2_3(all_results):
-    hotspots = identify_hotspots(all_results)
-    plot_hotspots(all_results, hotspots)
-    return hotspots
+    # complexity_hotspots.png is drawn by the render stage
+    return identify_hotspots(all_results)
 
 
 def task2_4(all_results):
     return compute_correlation(all_results)
 
 
-def task2_5(all_results):
-    return analyse_defects(all_results)
-
-def task3_1():
-    REPO_PATH = os.path.dirname(os.path.abspath(__file__))
-    SINCE_DATE = datetime(2023, 1, 1)
+def task2_5(all_results, churn_path=None):
+    return analyse_defects(all_results, churn_path=churn_path)
+
+COUPLING_COLUMNS = ["file1", "file2", "commits_together", "commits_file1", "commits_file2", "logical_coupling"]
+COUPLING_DTYPES = {"file1": str, "file2": str, "commits_together": "float64",
+                   "commits_file1": "int64", "commits_file2": "int64", "logical_coupling": "float64"}
+
+
+def coupling_chunks(co_change, min_commits=2, pair_mask=None, top_k=None, chunk_rows=None):
+    """
+    Logical coupling C(i,j) / min(C(i), C(j)) of all pairs with at least min_commits
+    common commits, as array operations over the consumer's pair arrays.
+    pair_mask(f1_ids, f2_ids) can restrict the pairs further. Rows are sorted by
+    coupling, ties in the order the pairs were first seen; with top_k only the
+    top_k rows are selected (argpartition) instead of sorting every pair, and ties
+    in coupling go to the pair with more common commits first, as in the charts.
+    The rows come as DataFrames of chunk_rows rows (at least one, maybe empty).
+    """
+    f1, f2, cij = co_change.pairs()
+    keep = cij >= min_commits  # decayed consumers have float counts
+    if pair_mask is not None:
+        keep &= pair_mask(f1, f2)
+    f1, f2, cij = f1[keep], f2[keep], cij[keep]
+
+    commits = np.array([co_change.file_count[p] for p in co_change.paths], dtype=co_change.pair_counts.dtype)
+    ci, cj = commits[f1], commits[f2]
+    lc = cij / np.minimum(ci, cj)
+
+    if top_k is not None:
+        # everything at least as coupled as the k-th pair, so ties at the cut are ranked like the rest
+        candidates = np.arange(len(lc))
+        if top_k < len(lc):
+            kth = np.partition(-lc, top_k - 1)[top_k - 1]
+            candidates = np.flatnonzero(-lc <= kth)
+        # lexsort is stable: pairs equal in both keys stay in first-seen order
+        order = candidates[np.lexsort((-cij[candidates], -lc[candidates]))][:top_k]
+    else:
+        order = np.argsort(-lc, kind="stable")
+
+    # only the rows of one chunk at a time become strings
+    paths = np.array(co_change.paths, dtype=object)
+    chunk_rows = chunk_rows or max(len(order), 1)
+    for start in range(0, max(len(order), 1), chunk_rows):
+        rows = order[start:start + chunk_rows]
+        yield pd.DataFrame({
+            "file1": paths[f1[rows]], "file2": paths[f2[rows]],
+            "commits_together": cij[rows],
+            "commits_file1": ci[rows], "commits_file2": cj[rows],
+            "logical_coupling": lc[rows],
+        }, columns=COUPLING_COLUMNS)
+
+
+def write_coupling_csv(chunks, out_path):
+    # streams the rows to out_path, returns the first 20 for printing
+    head = None
+    with TableWriter(out_path, COUPLING_COLUMNS) as writer:
+        for chunk in chunks:
+            if head is None:
+                head = chunk.head(20)
+            writer.write(chunk)
+    return head
+
+
+def task3_1(co_change=None):
     MIN_COMMITS_PAIR = 2  # threshold to filter noise
 
     def extract_commit_data():
-        file_count = Counter()
-        pair_count = Counter()
-
-        for i, commit in enumerate(Repository(REPO_PATH, since=SINCE_DATE).traverse_commits(), start=1):
-            if i % 50 == 0:
-                print(f"Processed {i} commits...")
-
-            changed = set()
-            for m in commit.modified_files:
-                path = m.new_path or m.old_path
-                if path and path.endswith('.py'):
-                    changed.add(path)
-
-            if not changed:
-                continue
-
-            for f in changed:
-                file_count[f] += 1
+        if co_change is None:
+            consumer, = mine_history([CoChangeConsumer()])
+        else:
+            consumer = co_change
+        print(f"Unique files touched: {len(consumer.file_count)}")
+        print(f"File pairs detected: {consumer.n_pairs}")
 
-            if len(changed) > 1:
-                for f1, f2 in combinations(sorted(changed), 2):
-                    pair_count[(f1, f2)] += 1
-
-        print("Finished extracting commits.")
-        print(f"Unique files touched: {len(file_count)}")
-        print(f"File pairs detected: {len(pair_count)}")
-
-        return file_count, pair_count
-
-    def compute_logical_coupling(file_count, pair_count):
-        results = []
-        for (f1, f2), cij in pair_count.items():
-            if cij < MIN_COMMITS_PAIR:
-                continue
-            ci, cj = file_count[f1], file_count[f2]
-            lc = cij / min(ci, cj)  # normalization
-            results.append((f1, f2, cij, ci, cj, lc))
+        return consumer.file_count, consumer
 
-        results.sort(key=lambda x: x[-1], reverse=True)
-        return results
+    def compute_logical_coupling(co_change_counts, top_k=None):
+        return coupling_chunks(co_change_counts, MIN_COMMITS_PAIR, top_k=top_k, chunk_rows=TABLE_CHUNK_ROWS)
 
     def main():
-        file_count, pair_count = extract_commit_data()
-        lc_results = compute_logical_coupling(file_count, pair_count)
-
-        df = pd.DataFrame(lc_results, columns=[
-            "file1", "file2",
-            "commits_together",
-            "commits_file1",
-            "commits_file2",
-            "logical_coupling"
-        ])
+        _, co_change_counts = extract_commit_data()
 
         # Write CSV
         out_path = "task3_code_pairs.csv"
-        df.to_csv(out_path, index=False)
+        head = write_coupling_csv(compute_logical_coupling(co_change_counts), out_path)
+        # the pairs of the chart, selected without sorting every pair
+        write_coupling_csv(compute_logical_coupling(co_change_counts, top_k=10), "task3_code_pairs_top10.csv")
 
         print(f"\nSaved CSV to: {out_path}")
         print("Top 20 rows:")
-        print(df.head(20))
+        print(head)
 
     main()
 
 
-def task3_2():
-    REPO_PATH = os.path.dirname(os.path.abspath(__file__))
-    SINCE_DATE = datetime(2023, 1, 1)
+def task3_2(co_change=None):
     MIN_COMMITS_PAIR = 2  # threshold to filter noise
 
     def is_test_file(path: str) -> bool:
@@ -363,101 +2186,240 @@ def task3_2():
         return False
 
     def extract_commit_data():
-        file_count = Counter()
-        pair_count = Counter()
+        # same counts as task3_1, the pairs are only filtered differently afterwards
+        if co_change is None:
+            consumer, = mine_history([CoChangeConsumer()])
+        else:
+            consumer = co_change
+        print(f"Unique files touched: {len(consumer.file_count)}")
+        print(f"File pairs detected (all): {consumer.n_pairs}")
 
-        for i, commit in enumerate(Repository(REPO_PATH, since=SINCE_DATE).traverse_commits(), start=1):
-            if i % 50 == 0:
-                print(f"Processed {i} commits...")
+        return consumer.file_count, consumer
 
-            changed = set()
-            for m in commit.modified_files:
-                path = m.new_path or m.old_path
-                if path and path.endswith(".py"):
-                    changed.add(path)
-
-            if not changed:
-                continue
+    def compute_test_code_coupling(co_change_counts, top_k=None):
+        is_test = np.array([is_test_file(p) for p in co_change_counts.paths], dtype=bool)
 
-            for f in changed:
-                file_count[f] += 1
-
-            # update pair counts
-            if len(changed) > 1:
-                for f1, f2 in combinations(sorted(changed), 2):
-                    pair_count[(f1, f2)] += 1
-
-        print("Finished extracting commits.")
-        print(f"Unique files touched: {len(file_count)}")
-        print(f"File pairs detected (all): {len(pair_count)}")
+        # skip pairs that are test–test or non-test–non-test
+        def test_code_pair(f1_ids, f2_ids):
+            return is_test[f1_ids] != is_test[f2_ids]
 
-        return file_count, pair_count
-
-    def compute_test_code_coupling(file_count, pair_count):
-        results = []
-
-        for (f1, f2), cij in pair_count.items():
-            if cij < MIN_COMMITS_PAIR:
-                continue
-
-            is_test1 = is_test_file(f1)
-            is_test2 = is_test_file(f2)
-
-            # skip pairs that are test–test or non-test–non-test
-            if is_test1 == is_test2:
-                continue
-
-            ci, cj = file_count[f1], file_count[f2]
-            lc = cij / min(ci, cj)  # same normalization as before
-
-            results.append((f1, f2, cij, ci, cj, lc))
-
-        results.sort(key=lambda x: x[-1], reverse=True)
-        return results
+        return coupling_chunks(co_change_counts, MIN_COMMITS_PAIR, pair_mask=test_code_pair, top_k=top_k,
+                               chunk_rows=TABLE_CHUNK_ROWS)
 
     def main():
-        file_count, pair_count = extract_commit_data()
+        _, co_change_counts = extract_commit_data()
         print("Computing logical coupling for TEST–CODE pairs only...")
-        lc_results = compute_test_code_coupling(file_count, pair_count)
-
-        df = pd.DataFrame(lc_results, columns=[
-            "file1", "file2",
-            "commits_together",
-            "commits_file1",
-            "commits_file2",
-            "logical_coupling"
-        ])
 
         # Write CSV
         out_path = "task3_test_code_pairs.csv"
-        df.to_csv(out_path, index=False)
+        head = write_coupling_csv(compute_test_code_coupling(co_change_counts), out_path)
+        write_coupling_csv(compute_test_code_coupling(co_change_counts, top_k=10), "task3_test_code_pairs_top10.csv")
 
         print(f"\nSaved CSV to: {out_path}")
         print("Top 20 rows:")
-        print(df.head(20))
+        print(head)
 
     main()
 
 
-def task3_4_1(file_path):
-    def mirror_structure(rel_src: Path) -> Path:
-        """
-        Mirror the structure exactly:
-        src/.../name.py  ->  tests/.../test_name.py
-        """
-        parts = list(rel_src.parts)
+# the coupling graph keeps pairs with at least this many common commits and this logical coupling
+GRAPH_MIN_COMMITS = 2
+GRAPH_MIN_COUPLING = 0.2
+MODELS_PREFIX = "src/transformers/models/"
+
 
-        if not parts or parts[0] != "src":
-            raise ValueError(f"Expected path starting with 'src/', got: {rel_src}")
+def coupling_graph(co_change, min_commits=GRAPH_MIN_COMMITS, min_coupling=GRAPH_MIN_COUPLING):
+    """
+    Weighted networkx graph (sparse adjacency dicts) of the coupled pairs: the
+    thresholds are applied to the pair arrays first, so only the kept edges are built.
+    Edge weight is the logical coupling, "commits" the number of common commits.
+    """
+    f1, f2, cij = co_change.pairs()
+    commits = np.array([co_change.file_count[p] for p in co_change.paths], dtype=co_change.pair_counts.dtype)
+    lc = cij / np.minimum(commits[f1], commits[f2])
+    keep = (cij >= min_commits) & (lc >= min_coupling)
 
-        parts[0] = "tests"
-        filename = parts[-1]
-        stem = Path(filename).stem
-        new_filename = f"test_{stem}.py"
-        parts[-1] = new_filename
+    graph = nx.Graph()
+    paths = co_change.paths
+    graph.add_edges_from((paths[a], paths[b], {"weight": w, "commits": c}) for a, b, w, c in
+                         zip(f1[keep].tolist(), f2[keep].tolist(), lc[keep].tolist(), cij[keep].tolist()))
+    return graph
 
-        return Path(*parts)
 
+def model_package(path):
+    # "bert" for src/transformers/models/bert/..., None outside the model packages
+    if not path.startswith(MODELS_PREFIX):
+        return None
+    package, sep, _ = path[len(MODELS_PREFIX):].partition("/")
+    return package if sep else None
+
+
+def analyse_coupling_graph(graph, seed=0, betweenness_samples=50):
+    """
+    Per file: connected component, Louvain community, coupling degree (coupled files),
+    strength (summed coupling), degree centrality and betweenness centrality, estimated
+    from betweenness_samples source files so it stays tractable on large graphs.
+    Per community: its size and the model packages it spans, with the edges crossing
+    them. Components and communities are numbered by size, largest first.
+    """
+    def numbered(groups):
+        ordered = sorted((sorted(group) for group in groups), key=lambda group: (-len(group), group[0]))
+        return {node: i for i, group in enumerate(ordered) for node in group}, ordered
+
+    component_of, _ = numbered(nx.connected_components(graph))
+    community_of, communities = numbered(nx.community.louvain_communities(graph, weight="weight", seed=seed))
+    samples = min(betweenness_samples, len(graph)) if betweenness_samples else None
+    betweenness = nx.betweenness_centrality(graph, k=samples, seed=seed) if len(graph) > 2 else {}
+    centrality = nx.degree_centrality(graph)
+    strength = dict(graph.degree(weight="weight"))
+
+    files = pd.DataFrame({
+        "file": list(graph.nodes),
+        "component": [component_of[n] for n in graph.nodes],
+        "community": [community_of[n] for n in graph.nodes],
+        "degree": [d for _, d in graph.degree()],
+        "strength": [strength[n] for n in graph.nodes],
+        "degree_centrality": [centrality[n] for n in graph.nodes],
+        "betweenness": [betweenness.get(n, 0.0) for n in graph.nodes],
+    }).sort_values(["community", "degree", "file"], ascending=[True, False, True]).reset_index(drop=True)
+
+    cross = defaultdict(lambda: [0, 0.0, None])
+    for a, b, data in graph.edges(data=True):
+        package_a, package_b = model_package(a), model_package(b)
+        if community_of[a] == community_of[b] and package_a and package_b and package_a != package_b:
+            entry = cross[community_of[a]]
+            entry[0] += 1
+            entry[1] += data["weight"]
+            if entry[2] is None or data["weight"] > entry[2][2]:
+                entry[2] = (min(a, b), max(a, b), data["weight"])
+
+    rows = []
+    for i, members in enumerate(communities):
+        packages = sorted({model_package(f) for f in members} - {None})
+        edges, weight, strongest = cross.get(i, (0, 0.0, None))
+        rows.append((i, len(members), len(packages), ";".join(packages), edges, weight,
+                     strongest[0] if strongest else None, strongest[1] if strongest else None))
+    clusters = pd.DataFrame(rows, columns=["community", "files", "model_packages", "packages", "cross_package_edges",
+                                           "cross_package_weight", "strongest_file1", "strongest_file2"])
+    return files, clusters
+
+
+def task3_graph(co_change, min_commits=GRAPH_MIN_COMMITS, min_coupling=GRAPH_MIN_COUPLING,
+                files_path="task3_coupling_graph_files.csv", clusters_path="task3_coupling_clusters.csv",
+                cross_path="task3_cross_package_clusters.csv"):
+    graph = coupling_graph(co_change, min_commits, min_coupling)
+    print(f"Coupling graph: {graph.number_of_nodes()} files, {graph.number_of_edges()} edges "
+          f"(at least {min_commits} common commits, coupling >= {min_coupling})")
+    files, clusters = analyse_coupling_graph(graph)
+    write_table(files, files_path)
+    write_table(clusters, clusters_path)
+
+    # communities joining files of different src/transformers/models/* packages
+    cross = clusters[clusters["cross_package_edges"] > 0].sort_values(
+        ["cross_package_weight", "community"], ascending=[False, True])
+    write_table(cross, cross_path)
+    print(f"{files['component'].nunique() if len(files) else 0} components, {len(clusters)} communities, "
+          f"{len(cross)} crossing model packages; saved to {files_path}, {clusters_path}, {cross_path}")
+    return files, clusters, cross
+
+
+# windows of the windowed coupling tables (months up to the newest one) and the half-life of the decayed one
+COUPLING_WINDOWS = (3, 6, 12)
+COUPLING_HALF_LIFE = 6
+
+
+def open_co_change_months(cache_path=CACHE_PATH):
+    conn = sqlite3.connect(cache_path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS co_change_commits (sha TEXT PRIMARY KEY, month TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS co_change_files (
+            month TEXT, file TEXT, commits INTEGER NOT NULL, PRIMARY KEY (month, file)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS co_change_pairs (
+            month TEXT, file1 TEXT, file2 TEXT, commits INTEGER NOT NULL, PRIMARY KEY (month, file1, file2)
+        ) WITHOUT ROWID;
+    """)
+    return conn
+
+
+def store_monthly_co_change(conn, monthly, commit_months):
+    # adds the counts of the new commits to the stored buckets
+    for year_month, bucket in monthly.buckets.items():
+        conn.executemany("INSERT INTO co_change_files VALUES (?, ?, ?) "
+                         "ON CONFLICT DO UPDATE SET commits = commits + excluded.commits",
+                         ((year_month, path, count) for path, count in bucket.file_count.items()))
+        conn.executemany("INSERT INTO co_change_pairs VALUES (?, ?, ?, ?) "
+                         "ON CONFLICT DO UPDATE SET commits = commits + excluded.commits",
+                         ((year_month, a, b, count) for a, b, count in bucket.pair_items()))
+    conn.executemany("INSERT INTO co_change_commits VALUES (?, ?)", commit_months)
+    conn.commit()
+
+
+def load_monthly_co_change(conn, max_files=None, oversized="skip"):
+    monthly = MonthlyCoChangeConsumer(max_files, oversized)
+    for year_month, in conn.execute("SELECT DISTINCT month FROM co_change_files ORDER BY month").fetchall():
+        files = conn.execute("SELECT file, commits FROM co_change_files WHERE month = ? ORDER BY file", (year_month,))
+        pairs = conn.execute("SELECT file1, file2, commits FROM co_change_pairs WHERE month = ? ORDER BY file1, file2",
+                             (year_month,))
+        monthly.buckets[year_month] = CoChangeConsumer.from_counts(files.fetchall(), pairs, max_files, oversized)
+    return monthly
+
+
+def update_monthly_co_change(repo_path=REPO_PATH, since=SINCE_DATE, cache_path=CACHE_PATH, backend=HISTORY_BACKEND,
+                             max_files=None, oversized="skip"):
+    """
+    The per-month co-change buckets of the history. They are stored in the cache and
+    only the commits not counted yet are added to them, so a run after new commits
+    touches just those. If counted commits left the history (rewritten, or a later
+    `since`) or the cap of oversized commits changed, the buckets are rebuilt.
+    """
+    if cache_path is None:
+        monthly, = mine_history([MonthlyCoChangeConsumer(max_files, oversized)], repo_path, since, cache_path, backend)
+        return monthly
+
+    shas = list_commit_shas(repo_path, since)
+    cap = json.dumps([max_files, oversized])
+    with closing(open_co_change_months(cache_path)) as conn:
+        counted = {sha for sha, in conn.execute("SELECT sha FROM co_change_commits")}
+        stored_cap = conn.execute("SELECT value FROM meta WHERE key = 'co_change_cap'").fetchone()
+        if not counted <= set(shas) or (counted and stored_cap != (cap,)):
+            print("Monthly co-change buckets do not match the history any more, rebuilding them")
+            conn.executescript("DELETE FROM co_change_commits; DELETE FROM co_change_files; DELETE FROM co_change_pairs;")
+            counted = set()
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('co_change_cap', ?)", (cap,))
+        # end the write, mining the new commits below opens the commit cache in the same file
+        conn.commit()
+        new = [sha for sha in shas if sha not in counted]
+        print(f"Monthly co-change buckets: {len(counted)} commits counted before, {len(new)} new")
+
+        if new:
+            delta, commit_months = MonthlyCoChangeConsumer(max_files, oversized), []
+            for commit in iter_commit_records(repo_path, since, cache_path, backend, shas=new):
+                delta.consume(commit)
+                commit_months.append((commit.hash, commit.committer_date.strftime("%Y-%m")))
+            store_monthly_co_change(conn, delta, commit_months)
+        return load_monthly_co_change(conn, max_files, oversized)
+
+
+def task3_windows(monthly, windows=COUPLING_WINDOWS, half_life=COUPLING_HALF_LIFE, min_commits=2):
+    """
+    task3_code_pairs.csv-style tables of the recent coupling: one per window of the
+    last N months (task3_code_pairs_last{N}m.csv) and one with exponentially decayed
+    counts (task3_code_pairs_decayed.csv), whose commit columns are decayed commit counts.
+    """
+    outputs = {}
+    for months in windows:
+        outputs[f"task3_code_pairs_last{months}m.csv"] = monthly.window(months)
+    outputs["task3_code_pairs_decayed.csv"] = monthly.decayed(half_life)
+    for out_path, co_change in outputs.items():
+        write_coupling_csv(coupling_chunks(co_change, min_commits, chunk_rows=TABLE_CHUNK_ROWS), out_path)
+        print(f"Saved {out_path} ({len(co_change.file_count)} files)")
+    return list(outputs)
+
+
+def task3_4_1(file_path):
     def to_repo_relative(path: Path) -> Path:
         return Path(path)
 
@@ -473,196 +2435,717 @@ def task3_4_1(file_path):
     main()
 
 
-def task3_4_2(file_path):
-    def find_repo_root(start: Path) -> Path:
-        current = start.resolve()
-        for parent in [current] + list(current.parents):
-            if (parent / ".git").is_dir():
-                return parent
-        raise RuntimeError(f"Could not find .git directory above {start}")
+def task3_4_2(file_path, cache_path=CACHE_PATH):
+    # find_test_by_imports and the import index live in fss_find_test.py, which find-test runs on its own
+    def main():
+        src_path = Path(file_path)
+        try:
+            test_rel = find_test_by_imports(src_path, cache_path)
+        except Exception as e:
+            print(f"[ERROR] {e}", file=sys.stderr)
+            sys.exit(1)
+
+        print(f"[RESULT] {test_rel}")
 
-    def to_repo_relative(path: Path, repo_root: Path) -> Path:
+    main()
+
+
+def expand_source_paths(patterns):
+    # paths or (recursive) globs, in the given order without duplicates
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        files.extend(Path(m) for m in matches if m.endswith(".py"))
+    return list(dict.fromkeys(files))
+
+
+def map_tests(src_files, out_path="task3_4_test_map.csv", cache_path=CACHE_PATH):
+    """
+    Batch version of task3_4_1 and task3_4_2: maps every source file (paths or globs)
+    to its mirrored test path and to the tests importing it, building the import index
+    once per repository. Writes one row per source file, as CSV or, for a .jsonl
+    out_path, JSON lines; misses are rows with an empty result and the reason.
+    """
+    start = time.perf_counter()
+    indexes = {}
+    rows = []
+
+    for src_file in expand_source_paths(src_files):
+        row = {"source": str(src_file), "module": None, "mirror_test": None, "mirror_exists": False,
+               "import_tests": [], "best_test": None, "error": None}
         try:
-            return path.resolve().relative_to(repo_root)
-        except ValueError:
-            raise RuntimeError(f"{path} is not inside repo root {repo_root}")
+            if not src_file.is_file():
+                raise FileNotFoundError(f"Source file does not exist: {src_file}")
+            repo_root = find_repo_root(src_file)
+            rel_src = src_file.resolve().relative_to(repo_root)
+
+            mirror = mirror_structure(rel_src)
+            row["mirror_test"] = mirror.as_posix()
+            row["mirror_exists"] = (repo_root / mirror).is_file()
+
+            row["module"] = compute_module_name(rel_src)
+            if repo_root not in indexes:
+                indexes[repo_root] = build_import_index(repo_root, cache_path)
+            tests = rank_tests(indexes[repo_root].tests_for(row["module"]))
+            row["import_tests"] = [t.as_posix() for t in tests]
+
+            if tests:
+                row["best_test"] = row["import_tests"][0]
+            elif row["mirror_exists"]:
+                row["best_test"] = row["mirror_test"]
+            else:
+                row["error"] = f"No test file imports module '{row['module']}' (or its symbols)."
+        except (OSError, ValueError, RuntimeError) as e:
+            row["error"] = str(e)
+        rows.append(row)
+
+    if str(out_path).endswith(".jsonl"):
+        with open(out_path, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+    else:
+        df = pd.DataFrame(rows, columns=list(rows[0]) if rows else None)
+        if rows:
+            df["import_tests"] = df["import_tests"].str.join(";")
+        df.to_csv(out_path, index=False)
 
-    def compute_module_name(rel_src: Path) -> str:
+    elapsed = time.perf_counter() - start
+    misses = sum(row["best_test"] is None for row in rows)
+    print(f"Mapped {len(rows)} source files ({misses} without a test) in {elapsed:.2f}s "
+          f"({elapsed / max(len(rows), 1) * 1000:.1f} ms per file), saved to {out_path}")
+    return rows
+
+
+class TestSelector:
+    """
+    Picks the tests to run for a set of changed files (repo-relative, as printed by
+    git diff --name-only). Signals per test, the strongest one gives the score:
+      changed test file                               1.0
+      imports a changed module, or one that reaches
+      it through depth src/ imports                   1 / (1 + depth)
+      test-code coupling with a changed file (Task 3.2)  logical coupling
+    Package __init__ modules are not followed as importers (they re-export everything).
+    The import indexes are built once, so a long-lived selector answers queries
+    without re-parsing the repository; reload() picks up edits.
+    """
+
+    def __init__(self, repo_root=REPO_PATH, coupling_csv="task3_test_code_pairs.csv", cache_path=CACHE_PATH,
+                 max_depth=2):
+        self.repo_root = Path(repo_root).resolve()
+        self.coupling_csv = coupling_csv
+        self.cache_path = cache_path
+        self.max_depth = max_depth
+        self.reload()
+
+    def reload(self):
+        start = time.perf_counter()
+        self.test_index = build_import_index(self.repo_root, self.cache_path)
+
+        # src/ module -> modules importing it
+        src_imports = scan_imports(self.repo_root, "src", "*.py", self.cache_path, resolve_relative=True)
+        self.modules = {}
+        packages = set()
+        for rel_src in src_imports:
+            module = compute_module_name(Path(rel_src))
+            if module.endswith(".__init__"):
+                module = module[:-len(".__init__")]
+                packages.add(module)
+            self.modules[rel_src] = module
+        known = set(self.modules.values())
+        self.importers = defaultdict(set)
+        for rel_src, names in src_imports.items():
+            importer = self.modules[rel_src]
+            if importer in packages:
+                # package __init__s re-export everything below them, following them would select every test
+                continue
+            for name in names:
+                # an imported name is a module or a symbol of one
+                target = name if name in known else name.rpartition(".")[0]
+                if target in known and target != importer:
+                    self.importers[target].add(importer)
+
+        # changed file -> [(test, logical coupling)]
+        self.coupled_tests = defaultdict(list)
+        if self.coupling_csv is not None and os.path.isfile(self.coupling_csv):
+            # the pair table can have millions of rows: only one chunk of it is held at a time
+            for pairs in read_table(self.coupling_csv, COUPLING_DTYPES, usecols=["file1", "file2", "logical_coupling"],
+                                    chunksize=TABLE_CHUNK_ROWS):
+                for f1, f2, lc in pairs.itertuples(index=False, name=None):
+                    if os.path.basename(f1).startswith("test_"):
+                        self.coupled_tests[f2].append((f1, lc))
+                    else:
+                        self.coupled_tests[f1].append((f2, lc))
+
+        print(f"Test selector ready: {len(self.test_index.names)} imported names, {len(self.modules)} src modules, "
+              f"{len(self.coupled_tests)} coupled files ({time.perf_counter() - start:.2f}s)", file=sys.stderr)
+
+    def select(self, changed, budget_ms=None, limit=None):
         """
-        Compute a Python module name from a repo-relative source path.
-        Example: src/transformers/data/processors/squad.py -> transformers.data.processors.squad
+        Ranked, deduplicated tests for the changed files as a dict with "tests"
+        ([{"test", "score", "reasons"}]), "unmapped" (changed files no signal knows about),
+        "truncated" (the budget stopped the walk over importers) and "elapsed_ms".
         """
-        parts = list(rel_src.parts)
+        start = time.perf_counter()
+        deadline = start + budget_ms / 1000 if budget_ms is not None else None
+        found = {}
+        unmapped = []
+        truncated = False
+
+        def add(test, score, reason):
+            test = Path(test).as_posix()
+            entry = found.setdefault(test, {"test": test, "score": 0.0, "reasons": []})
+            entry["score"] = max(entry["score"], score)
+            if reason not in entry["reasons"]:
+                entry["reasons"].append(reason)
+
+        for changed_file in dict.fromkeys(Path(p).as_posix() for p in changed):
+            mapped = False
+            if changed_file.startswith("tests/") and os.path.basename(changed_file).startswith("test"):
+                add(changed_file, 1.0, "changed")
+                mapped = True
+
+            for test, lc in self.coupled_tests.get(changed_file, ()):
+                add(test, float(lc), f"co-changes with {changed_file} ({lc:.2f})")
+                mapped = True
+
+            module = self.modules.get(changed_file)
+            if module is not None:
+                mapped = True
+                # breadth first over the modules importing the changed one,
+                # a test is credited for the closest module it imports
+                seen, level, reached = {module}, [module], set()
+                for depth in range(self.max_depth + 1):
+                    for mod in level:
+                        for test in self.test_index.tests_for(mod) - reached:
+                            reached.add(test)
+                            add(test, 1 / (1 + depth), f"imports {mod}" if depth == 0 else
+                                f"imports {mod} (depth {depth} from {module})")
+                    if depth == self.max_depth:
+                        break
+                    if deadline is not None and time.perf_counter() > deadline:
+                        truncated = True
+                        break
+                    level = [m for mod in level for m in self.importers.get(mod, ()) if m not in seen]
+                    seen.update(level)
+            if not mapped:
+                unmapped.append(changed_file)
+
+        tests = sorted(found.values(), key=lambda e: (-e["score"], -len(e["reasons"]), e["test"]))
+        if limit is not None:
+            tests = tests[:limit]
+        return {"tests": tests, "unmapped": unmapped, "truncated": truncated,
+                "elapsed_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+
+def serve_test_selection(selector, budget_ms=None, limit=None, lines=sys.stdin, out=sys.stdout):
+    """
+    Answer test selection queries from a line based stream: every line holds the
+    changed files of one query (whitespace separated), the answer is one JSON line.
+    "!reload" re-scans the repository, "!quit" or end of input stops.
+    """
+    for line in lines:
+        line = line.strip()
+        if line == "!quit":
+            break
+        if line == "!reload":
+            selector.reload()
+            continue
+        if line:
+            out.write(json.dumps(selector.select(line.split(), budget_ms, limit)) + "\n")
+            out.flush()
 
-        if not parts or parts[0] != "src":
-            raise ValueError(f"Source file must be under src/, got: {rel_src}")
 
-        # drop "src"
-        parts = parts[1:]
+def plot_task3(csv_path: str, out_path: str = "top10_bar.png"):
+    def plot_top10(csv_path: str, out_path: str = "top10_bar.png"):
+        if not os.path.isfile(csv_path):
+            raise FileNotFoundError(f"CSV file not found: {csv_path}")
 
-        # remove .py
-        if parts[-1].endswith(".py"):
-            parts[-1] = parts[-1][:-3]
+        # the top 10 table task3_1/task3_2 select with coupling_chunks(top_k=10)
+        top10 = read_table(csv_path, COUPLING_DTYPES).head(10)
 
-        if not parts:
-            raise ValueError(f"Cannot compute module name from path: {rel_src}")
+        labels = []
+        for file1, file2 in zip(top10["file1"], top10["file2"]):
+            left = os.path.basename(file1)
+            right = os.path.basename(file2)
+            labels.append(f"{left} & {right}")
 
-        return ".".join(parts)
+        # Plot
+        fig, ax = plt.subplots(figsize=(12, 6))
+        ax.barh(labels, top10["logical_coupling"])
+        ax.invert_yaxis()  # highest score at top
+        ax.set_xlabel("Logical Coupling (C(i,j) / min(C(i), C(j)))")
+        ax.set_title("Top 10 Most Logically Coupled File Pairs")
+        fig.tight_layout()
+        fig.savefig(out_path, dpi=200)
+        plt.close(fig)
 
-    def build_import_index(repo_root: Path) -> Dict[str, Set[Path]]:
-        tests_root = repo_root / "tests"
-        mapping: Dict[str, Set[Path]] = defaultdict(set)
+        print(f"Saved bar chart to: {out_path}")
 
-        if not tests_root.is_dir():
-            print(f"[WARN] No tests/ directory found under {repo_root}", file=sys.stderr)
-            return mapping
+    plot_top10(csv_path, out_path)
 
-        for test_path in tests_root.rglob("test*.py"):
-            rel_test = test_path.relative_to(repo_root)
-            imports_for_this_test: Set[str] = set()
 
-            try:
-                text = test_path.read_text(encoding="utf-8")
-            except (UnicodeDecodeError, OSError) as e:
-                print(f"[WARN] Could not read {rel_test}: {e}", file=sys.stderr)
-                continue
+# (chart, function drawing it, the tables it reads); function(*tables, chart)
+RENDER_JOBS = [
+    ("Task1Plot.png", plot_task_1, ["task1_defects_per_month.csv"]),
+    ("complexity_hotspots.png", plot_hotspots, ["task2_loc_cc.csv", "task2_hotspots.csv"]),
+    ("defects_vs_cc.png", plot_defects_vs_cc, ["task2_loc_cc_defects.csv"]),
+    ("defect_boxplot_cc_groups.png", plot_defect_boxplot, ["task2_loc_cc_defects.csv"]),
+    ("Task3_1Plot.png", plot_task3, ["task3_code_pairs_top10.csv"]),
+    ("Task3_2Plot.png", plot_task3, ["task3_test_code_pairs_top10.csv"]),
+]
 
-            try:
-                tree = ast.parse(text, filename=str(test_path))
-            except SyntaxError as e:
-                print(f"[WARN] Syntax error in {rel_test}: {e}", file=sys.stderr)
-                continue
 
-            # go through files and collect imports
-            for node in ast.walk(tree):
-                if isinstance(node, ast.Import):
-                    # e.g. "import transformers.data.processors.squad as squad_mod"
-                    for alias in node.names:
-                        name = alias.name  # "transformers.data.processors.squad"
-                        mapping[name].add(rel_test)
-                        imports_for_this_test.add(name)
-
-                elif isinstance(node, ast.ImportFrom):
-                    # e.g. "from transformers.data.processors.squad import SquadExample"
-                    mod = node.module  # "transformers.data.processors.squad"
-                    if mod is None:
-                        continue
-
-                    mapping[mod].add(rel_test)
-                    imports_for_this_test.add(mod)
-
-                    # Also index full name including imported symbol
-                    for alias in node.names:
-                        full_name = f"{mod}.{alias.name}"  # "transformers.data.processors.squad.SquadExample"
-                        mapping[full_name].add(rel_test)
-                        imports_for_this_test.add(full_name)
-
-            if imports_for_this_test:
-                imports_sorted = sorted(imports_for_this_test)
-            else:
-                imports_sorted = []
-            # print(f"[IMPORTS] {rel_test}: {imports_sorted}")
+def use_render_backend():
+    # runs in every render worker: figures only go to files, no display is needed
+    import matplotlib
+    matplotlib.use("Agg", force=True)
 
-        return mapping
 
-    def find_test_by_imports(src_file: Path) -> Path:
-        """
-        Input: a non-test source file, find the most related test file
-        """
-        if not src_file.is_file():
-            raise FileNotFoundError(f"Source file does not exist: {src_file}")
+def render_job(job):
+    out_path, function, tables = job
+    start = time.perf_counter()
+    function(*tables, out_path)
+    return out_path, time.perf_counter() - start
 
-        repo_root = find_repo_root(src_file)
-        rel_src = to_repo_relative(src_file, repo_root)
 
-        module_name = compute_module_name(rel_src)
-        print(f"[INPUT] Source file: {rel_src}")
-        # print(f"[INFO] Module name: {module_name}")
+def render_plots(jobs=RENDER_JOBS, workers=None):
+    """
+    Draw the charts from the tables the analysis stages wrote (or their columnar
+    copies), in worker processes with the Agg backend; every figure is closed after
+    it is saved, so none stay in memory.
+    """
+    workers = max(1, min(len(jobs), workers or os.cpu_count() or 1))
+    with futures.ProcessPoolExecutor(max_workers=workers, initializer=use_render_backend) as pool:
+        for out_path, seconds in pool.map(render_job, jobs):
+            print(f"Rendered {out_path} in {seconds:.2f}s")
+    return [out_path for out_path, _, _ in jobs]
 
-        import_index = build_import_index(repo_root)
-        direct_tests = import_index.get(module_name, set())
 
-        if not direct_tests:
-            # check entries where module_name is a prefix:
-            # e.g. module_name = transformers.data.processors.squad
-            # and index key = transformers.data.processors.squad.SquadExample
-            prefix = module_name + "."
-            candidates = {t for mod, tests in import_index.items() if mod.startswith(prefix) for t in tests}
+# A stage of the pipeline: inputs are files (usually outputs of other stages) or "history" /
+# "checkout" (the repository's commits / working tree), params the config keys it depends on,
+# after stages that must have run first without a file between them.
+Stage = namedtuple("Stage", ["name", "inputs", "outputs", "params", "after", "run"])
 
-            if not candidates:
-                raise RuntimeError(f"No test file imports module '{module_name}' (or its symbols).")
 
-            direct_tests = candidates
+def mine_config(config):
+    return config["repo_path"], config["since"], config["cache_path"], config["backend"]
 
-        best = sorted(
-            direct_tests,
-            key=lambda p: (len(p.parts), str(p))
-        )[0]
 
-        return best
+def co_change_consumer(config):
+    return CoChangeConsumer(config["max_files"], config["oversized"])
 
-    def main():
-        src_path = Path(file_path)
-        try:
-            test_rel = find_test_by_imports(src_path)
-        except Exception as e:
-            print(f"[ERROR] {e}", file=sys.stderr)
-            sys.exit(1)
 
-        print(f"[RESULT] {test_rel}")
+def run_mine_stage(config):
+    # fills the commit cache once, the stages reading the history then share it
+    defects, = mine_history([DefectConsumer()], *mine_config(config), config["workers"], config["slice_by"])
+    return {"commits": defects.n_commits}
 
-    main()
 
+def run_task1_stage(config):
+    defects, = mine_history([DefectConsumer()], *mine_config(config))
+    task1(defects)
+    return {"defective_commits": len(defects.defective_commits)}
 
-def plot_task3(csv_path: str, out_path: str = "top10_bar.png"):
-    def plot_top10(csv_path: str, out_path: str = "top10_bar.png"):
-        if not os.path.isfile(csv_path):
-            raise FileNotFoundError(f"CSV file not found: {csv_path}")
 
-        df = pd.read_csv(csv_path)
+def run_task2_2_stage(config):
+    all_results = task2_2(config["repo_path"], write_cloc_output=config["cloc_csv"])
+    return {"files": len(all_results)}
 
-        # Sort and select top 10
-        df_sorted = df.sort_values(
-            ["logical_coupling", "commits_together"],
-            ascending=[False, False]
-        )
-        top10 = df_sorted.head(10)
 
-        labels = []
-        for _, row in top10.iterrows():
-            left = os.path.basename(row["file1"])
-            right = os.path.basename(row["file2"])
-            labels.append(f"{left} & {right}")
+def load_loc_cc():
+    return read_table("task2_loc_cc.csv", {"file": str})
 
-        # Plot
-        plt.figure(figsize=(12, 6))
-        plt.barh(labels, top10["logical_coupling"])
-        plt.gca().invert_yaxis()  # highest score at top
-        plt.xlabel("Logical Coupling (C(i,j) / min(C(i), C(j)))")
-        plt.title("Top 10 Most Logically Coupled File Pairs")
-        plt.tight_layout()
-        plt.savefig(out_path, dpi=200)
-        plt.close()
 
-        print(f"Saved bar chart to: {out_path}")
+def run_task2_3_stage(config):
+    task2_3(load_loc_cc())
 
-    plot_top10(csv_path, out_path)
+
+def run_hotspot_scores_stage(config):
+    defects_per_file = read_table("defects_per_file.csv", DEFECT_DTYPES)
+    churn = read_table("churn_per_file.csv", CHURN_DTYPES)
+    activity, co_change = mine_history([FileActivityConsumer(), co_change_consumer(config)], *mine_config(config))
+    _, table = score_hotspots(hotspot_signals(load_loc_cc(), defects_per_file, activity, co_change, churn=churn))
+    return {"files": len(table)}
+
+
+def run_task2_4_stage(config):
+    task2_4(load_loc_cc())
+
+
+def run_churn_stage(config):
+    churn, = mine_history([ChurnConsumer()], *mine_config(config))
+    series, summary = write_churn_tables(churn)
+    return {"files": len(summary), "file_months": len(series)}
+
+
+def run_task2_5_stage(config):
+    all_results = load_loc_cc()
+    add_ranks(all_results)
+    task2_5(all_results, "churn_per_file.csv")
+
+
+def run_task3_coupling_stage(config):
+    co_change, = mine_history([co_change_consumer(config)], *mine_config(config))
+    task3_1(co_change)
+    task3_2(co_change)
+    return {"pairs": co_change.n_pairs}
+
+
+def run_task3_graph_stage(config):
+    co_change, = mine_history([co_change_consumer(config)], *mine_config(config))
+    files, clusters, cross = task3_graph(co_change)
+    return {"files": len(files), "communities": len(clusters), "cross_package": len(cross)}
+
+
+def run_task3_windows_stage(config):
+    monthly = update_monthly_co_change(*mine_config(config), config["max_files"], config["oversized"])
+    return {"months": len(monthly.buckets), "tables": len(task3_windows(monthly))}
+
+
+def run_task3_4_stage(config):
+    task3_4_1(config["source_file"])
+    task3_4_2(os.path.join(config["repo_path"], config["source_file"]))
+
+
+def run_task2_snapshots_stage(config):
+    summary = snapshot_metrics(config["repo_path"], config["since"], cache_path=config["cache_path"])
+    return {"snapshots": len(summary)}
+
+
+def run_render_stage(config):
+    return {"charts": len(render_plots())}
+
+
+def run_task2_functions_stage(config):
+    defects, = mine_history([DefectConsumer()], *mine_config(config))
+    table, _ = function_hotspots(config["repo_path"], defects.defective_commits)
+    return {"functions": len(table), "defective_commits": len(defects.defective_commits)}
+
+
+PIPELINE = [
+    Stage("mine", ["history"], [], ["workers", "slice_by"], [], run_mine_stage),
+    Stage("task1", ["history"], ["defects_per_file.csv", "task1_defects_per_month.csv"], ["columnar"], ["mine"],
+          run_task1_stage),
+    Stage("task2_2", ["checkout"], ["task2_loc_cc.csv"], ["cloc_csv", "columnar"], [], run_task2_2_stage),
+    Stage("task2_3", ["task2_loc_cc.csv"], ["task2_hotspots.csv"], ["columnar"], [], run_task2_3_stage),
+    Stage("task2_4", ["task2_loc_cc.csv"], ["task2_correlation.csv"], ["columnar"], [], run_task2_4_stage),
+    Stage("hotspot_scores", ["task2_loc_cc.csv", "defects_per_file.csv", "churn_per_file.csv", "history"],
+          ["task2_hotspot_scores.csv"],
+          ["columnar", "max_files", "oversized"], ["mine"], run_hotspot_scores_stage),
+    Stage("churn", ["history"], ["churn_per_file_month.csv", "churn_per_file.csv"], ["columnar"], ["mine"],
+          run_churn_stage),
+    Stage("task2_5", ["task2_loc_cc.csv", "defects_per_file.csv", "churn_per_file.csv"],
+          ["task2_loc_cc_defects.csv"], ["columnar"], [], run_task2_5_stage),
+    Stage("task3_coupling", ["history"], ["task3_code_pairs.csv", "task3_test_code_pairs.csv",
+                                          "task3_code_pairs_top10.csv", "task3_test_code_pairs_top10.csv"],
+          ["columnar", "max_files", "oversized"], ["mine"], run_task3_coupling_stage),
+    Stage("task3_graph", ["history"], ["task3_coupling_graph_files.csv", "task3_coupling_clusters.csv",
+                                       "task3_cross_package_clusters.csv"],
+          ["columnar", "max_files", "oversized"], ["mine"], run_task3_graph_stage),
+    Stage("task3_windows", ["history"],
+          [f"task3_code_pairs_last{months}m.csv" for months in COUPLING_WINDOWS] + ["task3_code_pairs_decayed.csv"],
+          ["columnar", "max_files", "oversized"], ["mine"], run_task3_windows_stage),
+    Stage("task3_4", ["checkout"], [], ["source_file"], [], run_task3_4_stage),
+    Stage("task2_functions", ["history", "checkout"], ["task2_functions.csv", "task2_function_hotspots.csv"],
+          ["columnar"], ["mine"], run_task2_functions_stage),
+    Stage("task2_snapshots", ["history"], ["task2_loc_cc_monthly.csv", "task2_hotspots_monthly.csv"], ["columnar"], [],
+          run_task2_snapshots_stage),
+    Stage("render", list(dict.fromkeys(table for _, _, tables in RENDER_JOBS for table in tables)),
+          [chart for chart, _, _ in RENDER_JOBS], [], [], run_render_stage),
+]
+# stages every subcommand runs (with what they depend on)
+COMMAND_STAGES = {
+    "mine": ["mine", "churn"],
+    "metrics": ["task2_2", "task2_3", "task2_4", "hotspot_scores", "task2_5"],
+    "coupling": ["task3_coupling", "task3_graph", "task3_windows"],
+    "plot": ["render"],
+}
+# only run when asked for with --stages
+OPTIONAL_STAGES = {"task2_functions", "task2_snapshots"}
+
+
+def stage_dependencies(stages):
+    # a stage depends on the stages producing its input files and on its "after" stages
+    producers = {output: stage.name for stage in stages for output in stage.outputs}
+    return {stage.name: {producers[i] for i in stage.inputs if i in producers} | set(stage.after) for stage in stages}
+
+
+def file_fingerprint(path):
+    with open(path, "rb") as f:
+        return git_blob_sha(f.read())
+
+
+def repository_fingerprints(config):
+    # "history": the commits the tasks see, "checkout": additionally the uncommitted state of the tree
+    repo_path = config["repo_path"]
+    head = git_output(repo_path, "rev-parse", "HEAD").strip()
+    history = hashlib.sha1(json.dumps([head, str(config["since"]), config["backend"], DEFECT_CLASSIFIER.key]).encode())
+    checkout = hashlib.sha1(head.encode())
+    checkout.update(subprocess.run(["git", "-C", str(repo_path), "diff", "HEAD", "--binary"],
+                                   capture_output=True, check=True).stdout)
+    for path in sorted(git_paths(repo_path, "ls-files", "--others", "--exclude-standard", "-z")):
+        stat = (Path(repo_path) / path).stat()
+        checkout.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode())
+    return {"history": history.hexdigest(), "checkout": checkout.hexdigest()}
+
+
+def stage_outputs(stage, config):
+    # with a columnar format every table also has its Parquet/Feather copy
+    if not config["columnar"]:
+        return list(stage.outputs)
+    return stage.outputs + [str(columnar_path(output, config["columnar"]))
+                            for output in stage.outputs if output.endswith(".csv")]
+
+
+def stage_fingerprint(stage, config, sources):
+    # sources: fingerprints of "history", "checkout" and this script; None if an input file is missing.
+    # Every stage is profiled with --profile, so the profiler is part of every fingerprint
+    parts = [stage.name, sources["code"], str(config["profile"])] + [str(config[key]) for key in stage.params]
+    for name in stage.inputs:
+        if name in sources:
+            parts.append(sources[name])
+        elif os.path.exists(name):
+            parts.append(file_fingerprint(name))
+        else:
+            return None
+    return hashlib.sha1(json.dumps(parts).encode()).hexdigest()
+
+
+def open_stage_state(cache_path=CACHE_PATH):
+    conn = sqlite3.connect(cache_path, timeout=60)
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    return conn
+
+
+def execute_stage(stage, config):
+    # runs in a worker process
+    global COLUMNAR_FORMAT, DEFECT_CLASSIFIER
+    COLUMNAR_FORMAT = config["columnar"]
+    DEFECT_CLASSIFIER = config["classifier"]
+    metrics = RunMetrics(path=None, profile=config["profile"])
+    try:
+        with metrics.stage(stage.name) as counters:
+            counters.update(stage.run(config) or {})
+    except SystemExit as e:
+        # task3_4_2 exits on a miss, that must not end the runner
+        raise RuntimeError(f"{stage.name} exited with status {e.code}") from None
+    return metrics.run["stages"][0]
+
+
+def run_pipeline(config, stages=PIPELINE, only=None, force=False, jobs=None, metrics=None):
+    """
+    Run the stages in dependency order, independent ones concurrently in up to jobs
+    processes. A stage is skipped when its fingerprint (this script, its params, the
+    repository state and the content of its input files) matches the last successful
+    run and its outputs (with their columnar copies) still exist. only restricts the run to these stages and the
+    stages they depend on. Returns {stage: "ran" | "up to date" | "failed" | "blocked"}.
+    """
+    deps = stage_dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    if only:
+        unknown = set(only) - set(by_name)
+        if unknown:
+            raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}")
+        wanted, todo = set(), list(only)
+        while todo:
+            name = todo.pop()
+            if name not in wanted:
+                wanted.add(name)
+                todo.extend(deps[name])
+        stages = [stage for stage in stages if stage.name in wanted]
+    else:
+        stages = [stage for stage in stages if stage.name not in OPTIONAL_STAGES]
+
+    sources = repository_fingerprints(config)
+    # the stages run this script and, for task3_4, fss_find_test.py
+    sources["code"] = "+".join(file_fingerprint(path) for path in (__file__, sys.modules["fss_find_test"].__file__))
+    status = {}
+    running = {}
+
+    with closing(open_stage_state(config["cache_path"])) as conn, \
+            futures.ProcessPoolExecutor(max_workers=jobs or min(len(stages), os.cpu_count() or 1)) as pool:
+        def finish(stage, result, fingerprint, error=None):
+            status[stage.name] = result
+            if result == "ran" and fingerprint is not None:
+                conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (f"stage:{stage.name}", fingerprint))
+                conn.commit()
+            if metrics is not None and result != "ran":
+                # stages that did not run are in the metrics too, so runs can be compared stage by stage
+                entry = {"stage": stage.name, "status": result}
+                if error is not None:
+                    entry["error"] = error
+                metrics.run["stages"].append(entry)
+                metrics.save()
+            print(f"[stage] {stage.name}: {result}")
+
+        while len(status) < len(stages):
+            finished = len(status)
+            for stage in stages:
+                if stage.name in status or stage.name in running:
+                    continue
+                if any(status.get(d) in ("failed", "blocked") for d in deps[stage.name]):
+                    finish(stage, "blocked", None)
+                    continue
+                if any(d not in status for d in deps[stage.name] if d in by_name):
+                    continue
+                # all inputs are final now, so the fingerprint covers what the upstream stages just wrote
+                fingerprint = stage_fingerprint(stage, config, sources)
+                last = conn.execute("SELECT value FROM meta WHERE key = ?", (f"stage:{stage.name}",)).fetchone()
+                if not force and fingerprint is not None and last == (fingerprint,) and \
+                        all(os.path.exists(output) for output in stage_outputs(stage, config)):
+                    finish(stage, "up to date", fingerprint)
+                    continue
+                running[stage.name] = (pool.submit(execute_stage, stage, config), fingerprint)
+
+            if not running:
+                if len(status) == finished:
+                    raise RuntimeError("Stage dependencies contain a cycle")
+                continue
+            done, _ = futures.wait([future for future, _ in running.values()], return_when=futures.FIRST_COMPLETED)
+            for name, (future, fingerprint) in list(running.items()):
+                if future not in done:
+                    continue
+                del running[name]
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    print(f"[stage] {name} failed: {e}", file=sys.stderr)
+                    finish(by_name[name], "failed", None, str(e))
+                    continue
+                if metrics is not None:
+                    metrics.run["stages"].append(entry)
+                    metrics.save()
+                finish(by_name[name], "ran", fingerprint)
+    return status
 
 
 if __name__ == "__main__":
-    print("Running Task 1...")
-    task1()
-    print("Finished Task 1.")
-    print("\nRunning Task 2...")
-    all_results = task2_2()
-    hotspots = task2_3(all_results)
-    correlation = task2_4(all_results)
-    defect_results = task2_5(all_results)
-    print("Finished Task 2.")
-    print("\nRunning Task 3...")
-    task3_1()
-    task3_2()
-    task3_4_1("src/transformers/generation/utils.py")
-    task3_4_2("transformers/src/transformers/generation/utils.py")
-    print("Finished Task 3.")
-    print("Finished all tasks successfully.")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Software evolution assignment: defects, complexity and coupling.")
+    parser.add_argument("--workers", type=int, default=1, help="processes used to mine the commit history")
+    parser.add_argument("--slice-by", choices=["commit", "date"], default="commit",
+                        help="how the commit range is split between workers")
+    parser.add_argument("--max-files", type=int,
+                        help="commits touching more files are handled by --oversized in the co-change pair counts "
+                             "(default: no cap)")
+    parser.add_argument("--oversized", choices=["skip", "downweight"], default="skip",
+                        help="skip commits above --max-files for the pairs, or down-weight them to max-files pairs")
+    parser.add_argument("--cloc-csv", action="store_true", help="also write the LoC counts as cloc_output.csv")
+    parser.add_argument("--columnar", choices=["parquet", "feather"],
+                        help="also write every table in this format next to its CSV (needs pyarrow)")
+    parser.add_argument("--metrics-out", default="run_metrics.json", help="per-stage timings of the run (JSON)")
+    parser.add_argument("--profile", choices=["cprofile", "pyinstrument"],
+                        help="also profile every stage into profiles/")
+    parser.add_argument("--defect-keywords", nargs="+", default=DEFECT_KEYWORDS, metavar="KEYWORD",
+                        help=f"words marking a defect commit (default: {' '.join(DEFECT_KEYWORDS)})")
+    parser.add_argument("--issue-refs", action="store_true",
+                        help="also count messages closing an issue (fixes/closes/resolves #1234) as defects")
+    parser.add_argument("--split-squashed", action="store_true",
+                        help="count every defect item of a squashed commit instead of the commit once")
+    parser.add_argument("--repo", default=REPO_PATH, help="path of the analysed repository")
+    parser.add_argument("--since", type=datetime.fromisoformat, default=SINCE_DATE,
+                        help="first commit date taken into account (YYYY-MM-DD)")
+    parser.add_argument("--source-file", default="src/transformers/generation/utils.py",
+                        help="repository-relative source file Task 3.4 finds the test of")
+    parser.add_argument("--stages", nargs="+", choices=[stage.name for stage in PIPELINE],
+                        help="only run these stages (and what they depend on); "
+                             f"{', '.join(sorted(OPTIONAL_STAGES))} only run this way")
+    parser.add_argument("--force", action="store_true", help="run stages even if they are up to date")
+    parser.add_argument("--jobs", type=int, help="stages run at the same time (default: one per core)")
+    parser.add_argument("--no-plots", action="store_true", help="skip the render stage, only write the tables")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND",
+                                     help="only run one part of the assignment or one tool (default: every stage)")
+    for command, help_text in [("mine", "mine the commit history into the cache, with churn and ownership"),
+                               ("metrics", "Task 2 tables: LoC/CC, hotspots, correlation, defects"),
+                               ("coupling", "Task 3 logical coupling tables (also windowed and decayed) and coupling graph clusters"),
+                               ("plot", "draw the charts from the tables (and what they need)")]:
+        commands.add_parser(command, help=f"{help_text} (stages: {', '.join(COMMAND_STAGES[command])})")
+    find_test = commands.add_parser("find-test", help="print the test file of a source file (Task 3.4); "
+                                                      "python fss_find_test.py does the same without loading "
+                                                      "this script, for hooks")
+    find_test.add_argument("source", help="repository-relative source file, e.g. src/transformers/generation/utils.py")
+    find_test.add_argument("--imports", action="store_true",
+                           help="also find the test importing the module (scans the tests, cached outside the "
+                                "repository)")
+    find_test.add_argument("--repo", dest="test_repo",
+                           help="path of the analysed repository (default: the git repository of the current directory)")
+    commands.add_parser("update-metrics", help="only refresh the Task 2 tables for files changed since the last run")
+    map_tests_command = commands.add_parser("map-tests", help="map source files or globs to their tests (batch Task 3.4)")
+    map_tests_command.add_argument("sources", nargs="+", metavar="SOURCE", help="source files or globs")
+    map_tests_command.add_argument("--out", default="task3_4_test_map.csv", help="output file, .csv or .jsonl")
+    select_tests = commands.add_parser("select-tests",
+                                       help="print the tests to run for the changed files; without files, "
+                                            "answer one query per stdin line")
+    select_tests.add_argument("changed", nargs="*", metavar="CHANGED",
+                              help="changed files, e.g. from git diff --name-only")
+    select_tests.add_argument("--budget-ms", type=float, help="latency budget of a query")
+    select_tests.add_argument("--max-tests", type=int, help="maximum number of selected tests")
+    benchmark = commands.add_parser("benchmark", help="run the benchmark suite on synthetic repositories; "
+                                                      "python fss_benchmark.py does the same")
+    benchmark.add_argument("scales", nargs="*", metavar="SCALE",
+                           help="repository sizes to run (small, medium, large; default: small medium)")
+    benchmark.add_argument("--reports", nargs="+", default=[], metavar="REPORT",
+                           help="also run these reports on every scale (backends: pydriller vs. git log, "
+                                "scaling: mining with 1, 2, 4, ... workers, cc-scan: cold vs. warm CC scan, "
+                                "co-change-memory: peak RSS of the pair counting)")
+    commands.add_parser("classifier-throughput",
+                        help="report the defect classifier's throughput over the commit history")
+    commands.add_parser("check-loc", help="check the LoC counter against the expected counts in cloc_corpus/")
+    args = parser.parse_args()
+
+    if args.command == "find-test":
+        sys.exit(find_test_main([args.source] + ["--imports"] * args.imports +
+                                (["--repo", args.test_repo] if args.test_repo else [])))
+    if args.command == "benchmark":
+        from fss_benchmark import main as benchmark_main
+        sys.exit(benchmark_main(args.scales + (["--reports", *args.reports] if args.reports else [])))
+    if args.command and args.stages:
+        parser.error("--stages cannot be combined with a command")
+    if args.no_plots and (args.command == "plot" or "render" in (args.stages or ())):
+        parser.error("--no-plots cannot be combined with rendering")
+
+    COLUMNAR_FORMAT = args.columnar
+    DEFECT_CLASSIFIER = DefectClassifier(args.defect_keywords, ISSUE_REFERENCES if args.issue_refs else (),
+                                         args.split_squashed)
+
+    if args.command == "check-loc":
+        sys.exit(1 if len(check_loc_corpus(Path(__file__).parent / "cloc_corpus")) else 0)
+
+    if args.command == "update-metrics":
+        refresh_task2_tables(args.repo)
+        sys.exit(0)
+
+    if args.command == "classifier-throughput":
+        report_classifier_throughput(repo_path=args.repo, since=args.since)
+        sys.exit(0)
+
+    if args.command == "map-tests":
+        map_tests(args.sources, args.out)
+        sys.exit(0)
+
+    if args.command == "select-tests":
+        selector = TestSelector(args.repo)
+        if args.changed:
+            print(json.dumps(selector.select(args.changed, args.budget_ms, args.max_tests), indent=2))
+        else:
+            serve_test_selection(selector, args.budget_ms, args.max_tests)
+        sys.exit(0)
+
+    config = {
+        "repo_path": args.repo, "since": args.since, "cache_path": CACHE_PATH, "backend": HISTORY_BACKEND,
+        "workers": args.workers, "slice_by": args.slice_by, "cloc_csv": args.cloc_csv,
+        "max_files": args.max_files, "oversized": args.oversized,
+        "source_file": args.source_file, "columnar": args.columnar, "profile": args.profile,
+        "classifier": DEFECT_CLASSIFIER,
+    }
+    metrics = RunMetrics(args.metrics_out, args.profile)
+    only = COMMAND_STAGES[args.command] if args.command else args.stages
+    stages = [stage for stage in PIPELINE if not (args.no_plots and stage.name == "render")]
+    status = run_pipeline(config, stages, only=only, force=args.force, jobs=args.jobs, metrics=metrics)
+    metrics.save()
+
+    failed = [name for name, result in status.items() if result in ("failed", "blocked")]
+    if failed:
+        print(f"Failed or blocked stages: {', '.join(failed)}")
+        sys.exit(1)
+    print("Finished all tasks successfully.")
+    print(f"Stage metrics saved to {args.metrics_out}")